@@ -46,6 +46,9 @@ CHEAT_PUNISHMENT_LEVELS = {
 # Number of days after which cheat count resets to zero
 CHEAT_PUNISHMENT_RESET_DAYS = 30
 
+# Most recent transactions kept in users.history; the full ledger lives in transactions
+USER_HISTORY_LIMIT = int(os.getenv("USER_HISTORY_LIMIT", "50"))
+
 TOKEN_ATTRIBUTES = {
     "DharmaPoints": {"expiry_days": 365, "stackable": True, "daily_decay": 0.0},
     "SevaPoints": {"expiry_days": 365, "stackable": True, "daily_decay": 0.0005},
@@ -57,6 +60,14 @@ TOKEN_ATTRIBUTES = {
     }
 }
 
+# When true, read endpoints compute decayed balances on the fly instead of writing
+# them back; decay is then materialized only by writes and the decay sweeper
+LAZY_DECAY_READS = os.getenv("LAZY_DECAY_READS", "true").lower() == "true"
+
+# Decay sweeper: users per bulk_write batch and pause between batches (seconds)
+DECAY_SWEEP_BATCH_SIZE = int(os.getenv("DECAY_SWEEP_BATCH_SIZE", "1000"))
+DECAY_SWEEP_PAUSE_SECONDS = float(os.getenv("DECAY_SWEEP_PAUSE_SECONDS", "0.5"))
+
 # Paap classification for different actions
 PAAP_CLASSES = {
     "cheat": "medium",
@@ -105,6 +116,13 @@ ATONEMENT_REWARDS = {
     "maha": {"token": "PaapTokens.maha", "value": 10}
 }
 
+# Weights of the positive tokens in the merit score (and the Punya side of net karma)
+MERIT_WEIGHTS = {
+    "DharmaPoints": 1.0,
+    "SevaPoints": 1.2,
+    "PunyaTokens": 3.0
+}
+
 LEVEL_THRESHOLDS = {
     "learner": 0,
     "volunteer": 50,
@@ -115,4 +133,66 @@ LEVEL_THRESHOLDS = {
 # Q-learning hyperparameters
 ALPHA = float(os.getenv("ALPHA", "0.15"))
 GAMMA = float(os.getenv("GAMMA", "0.9"))
-EPSILON = float(os.getenv("EPSILON", "0.2"))
\ No newline at end of file
+EPSILON = float(os.getenv("EPSILON", "0.2"))
+
+# Q-table persistence: flush every QTABLE_FLUSH_INTERVAL seconds, or sooner once
+# QTABLE_FLUSH_EVERY updates are pending
+QTABLE_FLUSH_INTERVAL = float(os.getenv("QTABLE_FLUSH_INTERVAL", "5"))
+QTABLE_FLUSH_EVERY = int(os.getenv("QTABLE_FLUSH_EVERY", "50"))
+
+# "replace" writes the whole table on flush (single worker); "delta" pushes per-cell
+# $inc deltas and pulls the merged table, so multiple workers' learning combines
+QTABLE_SYNC_MODE = os.getenv("QTABLE_SYNC_MODE", "replace")
+
+# Seconds to wait for the stored Q-table at startup before serving with zeros
+QTABLE_LOAD_TIMEOUT = float(os.getenv("QTABLE_LOAD_TIMEOUT", "5"))
+
+# Micro-batched learning: when enabled, requests only enqueue transitions into a ring
+# buffer of QLEARNING_BUFFER_SIZE and a background task applies them every
+# QLEARNING_BATCH_INTERVAL seconds
+QLEARNING_BATCH_MODE = os.getenv("QLEARNING_BATCH_MODE", "false").lower() == "true"
+QLEARNING_BUFFER_SIZE = int(os.getenv("QLEARNING_BUFFER_SIZE", "10000"))
+QLEARNING_BATCH_INTERVAL = float(os.getenv("QLEARNING_BATCH_INTERVAL", "0.5"))
+
+# Bulk event ingestion: maximum events per batch request and how many users'
+# events are processed concurrently (each user's events run in order)
+EVENT_BATCH_MAX_SIZE = int(os.getenv("EVENT_BATCH_MAX_SIZE", "5000"))
+EVENT_BATCH_CONCURRENCY = int(os.getenv("EVENT_BATCH_CONCURRENCY", "16"))
+
+# Event queue: "sync" processes gateway events in the request; "async" stores them as
+# pending, answers 202 and leaves them to EVENT_QUEUE_WORKERS background workers per
+# process (a request may also pick its mode with ?mode=). Claims are leased for
+# EVENT_QUEUE_LEASE_SECONDS; idle workers poll every EVENT_QUEUE_POLL_INTERVAL seconds.
+EVENT_PROCESSING_MODE = os.getenv("EVENT_PROCESSING_MODE", "sync")
+EVENT_QUEUE_WORKERS = int(os.getenv("EVENT_QUEUE_WORKERS", "2"))
+EVENT_QUEUE_LEASE_SECONDS = float(os.getenv("EVENT_QUEUE_LEASE_SECONDS", "60"))
+EVENT_QUEUE_POLL_INTERVAL = float(os.getenv("EVENT_QUEUE_POLL_INTERVAL", "1"))
+EVENT_QUEUE_MAX_ATTEMPTS = int(os.getenv("EVENT_QUEUE_MAX_ATTEMPTS", "5"))
+# Queued events whose handler fails with a 5xx are retried after EVENT_QUEUE_RETRY_BACKOFF_SECONDS,
+# doubling with each attempt, until EVENT_QUEUE_MAX_ATTEMPTS is reached
+EVENT_QUEUE_RETRY_BACKOFF_SECONDS = float(os.getenv("EVENT_QUEUE_RETRY_BACKOFF_SECONDS", "5"))
+# Events processed in the request (sync mode and batches) are leased to that request for
+# EVENT_SYNC_LEASE_SECONDS; if it dies, a retry with the same key or a queue worker takes over
+EVENT_SYNC_LEASE_SECONDS = float(os.getenv("EVENT_SYNC_LEASE_SECONDS", "300"))
+
+# How often the gateway samples event-loop lag for GET /v1/karma/event/metrics (seconds)
+LOOP_LAG_SAMPLE_INTERVAL = float(os.getenv("LOOP_LAG_SAMPLE_INTERVAL", "0.5"))
+
+# Optimistic concurrency for user documents: when enabled, the action pipeline only
+# commits if the document's version is unchanged since it was read, retrying up to
+# USER_WRITE_MAX_RETRIES times. Within one process every balance writer (actions,
+# redeem, atonement rewards, rebirth) holds the user's lock, and balance changes are
+# $inc'd, so this is only needed when several processes write the same users.
+USER_OPTIMISTIC_CONCURRENCY = os.getenv("USER_OPTIMISTIC_CONCURRENCY", "false").lower() == "true"
+USER_WRITE_MAX_RETRIES = int(os.getenv("USER_WRITE_MAX_RETRIES", "3"))
+
+# Atonement plan listings are paginated: default and maximum plans per page
+ATONEMENT_PAGE_SIZE = int(os.getenv("ATONEMENT_PAGE_SIZE", "50"))
+ATONEMENT_MAX_PAGE_SIZE = int(os.getenv("ATONEMENT_MAX_PAGE_SIZE", "500"))
+
+# A redeem idempotency key is held as pending while its debit runs; a claim left behind
+# by a crashed request may be taken over by a retry after REDEEM_CLAIM_TTL_SECONDS.
+# The debit itself records the key on the user (the newest REDEEM_KEYS_KEPT), so a
+# takeover can never debit the same key twice.
+REDEEM_CLAIM_TTL_SECONDS = float(os.getenv("REDEEM_CLAIM_TTL_SECONDS", "30"))
+REDEEM_KEYS_KEPT = int(os.getenv("REDEEM_KEYS_KEPT", "100"))
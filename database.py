@@ -1,4 +1,4 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
 from config import MONGO_URI, DB_NAME
 
 client = MongoClient(MONGO_URI)
@@ -12,7 +12,26 @@ appeals_col = db["appeals"]
 atonements_col = db["atonements"]
 death_events_col = db["death_events"]
 karma_events_col = db["karma_events"]  # New collection for unified events
+job_checkpoints_col = db["job_checkpoints"]  # Resume points for batch jobs
+counters_col = db["counters"]  # Materialized system-wide stats
+
+# Async client awaited by the request handlers so queries never block the event loop.
+# The sync collections above remain for scripts and offline jobs.
+async_client = AsyncMongoClient(MONGO_URI)
+async_db = async_client[DB_NAME]
+
+async_users_col = async_db["users"]
+async_transactions_col = async_db["transactions"]
+async_qtable_col = async_db["q_table"]
+async_appeals_col = async_db["appeals"]
+async_atonements_col = async_db["atonements"]
+async_death_events_col = async_db["death_events"]
+async_karma_events_col = async_db["karma_events"]
+async_counters_col = async_db["counters"]
 
 # Function to get database instance
 def get_db():
     return db
+
+def get_async_db():
+    return async_db
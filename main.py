@@ -1,13 +1,49 @@
+import asyncio
+import os
+import socket
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from database import async_client
+from logging_config import setup_logging, shutdown_logging
+from utils.qlearning import load_q_table, run_q_table_flusher, run_q_batch_learner, flush_q_table, q_table
+from utils.event_queue import run_event_worker
+from utils.gateway_metrics import gateway_metrics
+from utils.responses import MongoJSONResponse
+from config import EVENT_QUEUE_WORKERS
 from routes.v1.karma.main import router as karma_router
+from routes.v1.karma.event import process_queued_event
 from routes import balance, redeem, policy
 # from routes import user, admin  # These modules don't exist yet
 
+setup_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bounded by QTABLE_LOAD_TIMEOUT; on failure we serve with zeros and retry on flush
+    await load_q_table()
+    tasks = [asyncio.create_task(run_q_table_flusher()), asyncio.create_task(gateway_metrics.run_lag_monitor())]
+    if q_table.buffer is not None:
+        tasks.append(asyncio.create_task(run_q_batch_learner()))
+    # Workers for events accepted in async mode; unfinished claims are retried after their lease
+    worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+    for i in range(EVENT_QUEUE_WORKERS):
+        tasks.append(asyncio.create_task(run_event_worker(process_queued_event, f"{worker_prefix}-{i}")))
+    yield
+    for task in tasks:
+        task.cancel()
+    # Apply buffered transitions and persist any Q updates made since the last flush
+    await flush_q_table()
+    # Release the async MongoDB connection pool on shutdown
+    await async_client.close()
+    shutdown_logging()
+
 app = FastAPI(
     title="KarmaChain v2 (Dual-Ledger)",
     description="A modular, portable karma tracking system for multi-department integration",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=MongoJSONResponse
 )
 
 # Configure CORS for cross-domain requests
@@ -12,6 +12,8 @@ class RedeemRequest(BaseModel):
     user_id: str
     token_type: str
     amount: float
+    # Retries with the same key return the original result instead of redeeming again
+    idempotency_key: Optional[str] = None
 
 class KarmaEvent(BaseModel):
     """Model for storing unified events in karma_events collection"""
@@ -23,5 +25,10 @@ class KarmaEvent(BaseModel):
     status: str = "processed"  # processed, failed, pending
     response_data: Optional[Dict[str, Any]] = None
     error_message: Optional[str] = None
+    idempotency_key: Optional[str] = None
+    # Set while the event is queued, or claimed by a worker or by the request processing it
+    lease_expires_at: Optional[datetime] = None
+    claimed_by: Optional[str] = None
+    attempts: int = 0
     created_at: datetime = None
     updated_at: Optional[datetime] = None
@@ -1,17 +1,17 @@
 from fastapi import APIRouter, HTTPException
-from database import users_col
-from utils.tokens import apply_decay_and_expiry
+from utils.user_repository import get_user, ROLE_BALANCES
+from utils.tokens import decay_for_read
 from utils.merit import compute_user_merit_score
 from config import TOKEN_ATTRIBUTES
 
 router = APIRouter()
 
 @router.get("/view-balance/{user_id}")
-def view_balance(user_id: str):
-    user = users_col.find_one({"user_id": user_id})
+async def view_balance(user_id: str):
+    user = await get_user(user_id, ROLE_BALANCES)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    user = apply_decay_and_expiry(user)
+    user = await decay_for_read(user)
     merit_score = compute_user_merit_score(user)
     return {
         "user_id": user_id,
@@ -1,10 +1,73 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response
+import hashlib
+import json
 import numpy as np
-from utils.qlearning import Q, states, ACTIONS
+from utils.qlearning import get_q_table, states, ACTIONS
 
 router = APIRouter()
 
-@router.get("/policy/")
-def best_policy():
+# Policy views for the last seen Q-table generation; rebuilt only when it changes
+_cache = {"generation": None}
+
+def _etag(payload):
+    # Weak: bodies that differ only in ``generation`` share a tag, since the policy they describe is the same
+    return 'W/"' + hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest() + '"'
+
+def _policy_views():
+    global _cache
+    table = get_q_table()
+    generation = table.generation
+    cached = _cache
+    if cached["generation"] == generation:
+        return cached
+
+    Q = table.snapshot()
+    visits = table.visit_counts()
     policy = {state: ACTIONS[int(np.argmax(Q[i]))] for i, state in enumerate(states)}
-    return {"best_policy": policy, "Q_shape": Q.shape}
+    details = {}
+    for i, state in enumerate(states):
+        best = int(np.argmax(Q[i]))
+        others = np.delete(Q[i], best)
+        details[state] = {
+            "best_action": ACTIONS[best],
+            "margin": float(Q[i, best] - others.max()) if others.size else 0.0,
+            "q_values": {action: float(Q[i, j]) for j, action in enumerate(ACTIONS)},
+            "visits": {action: int(visits[i, j]) for j, action in enumerate(ACTIONS)}
+        }
+
+    policy_body = {"best_policy": policy, "Q_shape": list(Q.shape)}
+    details_body = {"policy": details, "Q_shape": list(Q.shape)}
+    # Most updates leave the best action per state unchanged, so the tag only covers the policy itself
+    views = {
+        "generation": generation,
+        "policy": ({**policy_body, "generation": generation}, _etag(policy_body)),
+        "details": ({**details_body, "generation": generation}, _etag(details_body))
+    }
+    # Swap in a complete dict so concurrent readers never see the new generation without its views
+    _cache = views
+    return views
+
+def _conditional(request: Request, response: Response, body, etag):
+    """Return a 304 when the client already holds ``etag``, otherwise ``body`` tagged with it."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    opaque_tag = etag.removeprefix("W/")
+    if opaque_tag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return body
+
+@router.get("/policy/")
+def best_policy(request: Request, response: Response):
+    body, etag = _policy_views()["policy"]
+    return _conditional(request, response, body, etag)
+
+@router.get("/policy/details")
+def policy_details(request: Request, response: Response):
+    """
+    Q values, the margin of the best action over the runner-up and per-cell
+    visit counts (updates applied by this worker since startup) for each state.
+    """
+    body, etag = _policy_views()["details"]
+    return _conditional(request, response, body, etag)
@@ -1,29 +1,171 @@
-from fastapi import APIRouter, HTTPException
+from datetime import timedelta
+from typing import Optional
+from bson import ObjectId
+from fastapi import APIRouter, Header, HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from models import RedeemRequest
-from database import users_col, transactions_col
-from utils.tokens import apply_decay_and_expiry, now_utc
-from config import TOKEN_ATTRIBUTES
+from database import async_users_col, async_transactions_col
+from utils.user_repository import user_exists, BALANCES
+from utils.tokens import decayed_balance_expr, now_utc
+from utils.decay_sweeper import SWEPT_TOKENS
+from utils.stats_counters import bump_system_stats
+from utils.user_locks import user_locks
+from config import TOKEN_ATTRIBUTES, REDEEM_CLAIM_TTL_SECONDS, REDEEM_KEYS_KEPT
 
 router = APIRouter()
 
+# Tokens held as a single number; PaapTokens is a per-severity dict and cannot be redeemed
+REDEEMABLE_TOKENS = SWEPT_TOKENS
+# Claim attempts before giving up on a key that keeps being released under us
+REDEEM_CLAIM_ATTEMPTS = 3
+
+async def debit_balance(user_id, token, amount, key=None):
+    """
+    Atomically materialize decay and debit ``amount`` of ``token``.
+
+    The balance check is part of the update filter, so concurrent redemptions
+    can never overdraw: the filter and the write are applied to the document as
+    one operation by MongoDB. With an idempotency ``key`` the filter also
+    requires that the key is not among the user's ``redeem_keys``, and the
+    write appends it, so one key debits at most once.
+
+    Returns:
+        dict: The post-image of the user's balances, or None if the user does not
+        exist, the decayed balance is below ``amount`` or ``key`` was already used
+    """
+    now = now_utc()
+    balance = decayed_balance_expr(token, now)
+    decay = {f"balances.{t}": decayed_balance_expr(t, now) for t in REDEEMABLE_TOKENS}
+    decay.update({f"token_meta.{t}.last_update": now for t in TOKEN_ATTRIBUTES})
+    decay["last_decay"] = now
+    decay["version"] = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+    decay["stats.total_actions"] = {"$add": [{"$ifNull": ["$stats.total_actions", 0]}, 1]}
+    query = {"user_id": user_id, "$expr": {"$gte": [balance, amount]}}
+    if key:
+        query["redeem_keys"] = {"$ne": key}
+        # $literal, since a key starting with "$" would otherwise read as a field path
+        used = {"$concatArrays": [{"$ifNull": ["$redeem_keys", []]}, [{"$literal": key}]]}
+        decay["redeem_keys"] = {"$slice": [used, -REDEEM_KEYS_KEPT]}
+    return await async_users_col.find_one_and_update(
+        query,
+        [
+            {"$set": decay},
+            {"$set": {f"balances.{token}": {"$subtract": [f"$balances.{token}", amount]}}}
+        ],
+        projection=BALANCES,
+        return_document=ReturnDocument.AFTER
+    )
+
+def _claim_filter(req, key, claim_id):
+    return {"user_id": req.user_id, "idempotency_key": key, "claim_id": claim_id, "status": "pending"}
+
+async def claim_idempotency_key(req, key):
+    """
+    Record a pending redeem transaction under ``key``, owned by a fresh claim ID.
+
+    A pending claim whose ``claim_expires_at`` has passed was left by a request
+    that died or stalled mid-redeem, and is taken over; the keyed debit keeps
+    the takeover from redeeming again if the original already debited.
+
+    Returns:
+        tuple: (claim_id, previous) - the claim ID if this request now owns ``key``,
+        otherwise None and the transaction already recorded under it
+    """
+    claim_id = ObjectId()
+    for _ in range(REDEEM_CLAIM_ATTEMPTS):
+        now = now_utc()
+        claim = {"claim_id": claim_id, "claim_expires_at": now + timedelta(seconds=REDEEM_CLAIM_TTL_SECONDS), "timestamp": now}
+        try:
+            await async_transactions_col.insert_one({
+                "user_id": req.user_id,
+                "action": "redeem",
+                "token": req.token_type,
+                "amount": float(req.amount),
+                "idempotency_key": key,
+                "status": "pending",
+                **claim
+            })
+            return claim_id, None
+        except DuplicateKeyError:
+            pass
+
+        # Claims written before expiries existed have none and count as expired
+        taken = await async_transactions_col.find_one_and_update(
+            {"user_id": req.user_id, "idempotency_key": key, "status": "pending", "claim_expires_at": {"$not": {"$gt": now}}},
+            {"$set": claim}
+        )
+        if taken:
+            return claim_id, None
+        previous = await async_transactions_col.find_one({"user_id": req.user_id, "idempotency_key": key}, {"_id": 0})
+        if previous:
+            return None, previous
+        # The claim was released between the insert and the lookup; try again
+    raise HTTPException(status_code=409, detail="A redemption with this idempotency key is in progress")
+
+async def release_claim(req, key, claim_id):
+    """Drop a claim whose debit did not happen, freeing ``key`` for a later retry."""
+    await async_transactions_col.delete_one(_claim_filter(req, key, claim_id))
+
 @router.post("/redeem/")
-def redeem(req: RedeemRequest):
-    if req.token_type not in TOKEN_ATTRIBUTES:
+async def redeem(req: RedeemRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    Redeem tokens with a single conditional update.
+
+    Retries carrying the same idempotency key (``Idempotency-Key`` header or
+    ``idempotency_key`` field) return the original result instead of redeeming again.
+    """
+    if req.token_type not in REDEEMABLE_TOKENS:
         raise HTTPException(status_code=400, detail="Invalid token type")
-    user = users_col.find_one({"user_id": req.user_id})
+    if req.amount <= 0:
+        raise HTTPException(status_code=400, detail="Insufficient balance or invalid amount")
+
+    key = idempotency_key or req.idempotency_key
+    claim_id = None
+    if key:
+        claim_id, previous = await claim_idempotency_key(req, key)
+        if previous:
+            if previous.get("status") == "completed":
+                return previous["response"]
+            raise HTTPException(status_code=409, detail="A redemption with this idempotency key is in progress")
+
+    try:
+        # Serialized with the action pipeline's read-modify-write of the same user
+        async with user_locks.hold(req.user_id):
+            user = await debit_balance(req.user_id, req.token_type, float(req.amount), key)
+    except Exception:
+        if claim_id:
+            await release_claim(req, key, claim_id)
+        raise
+    debited = user is not None
+    if not debited and key:
+        # An earlier attempt under this key debited but never recorded its response
+        user = await async_users_col.find_one({"user_id": req.user_id, "redeem_keys": key}, BALANCES)
     if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    user = apply_decay_and_expiry(user)
-    bal = user["balances"].get(req.token_type, 0.0)
-    if bal >= req.amount and req.amount > 0:
-        users_col.update_one({"user_id": req.user_id}, {"$inc": {f"balances.{req.token_type}": -float(req.amount)}})
-        transactions_col.insert_one({
+        if claim_id:
+            # Nothing was debited, so free the key for a later retry
+            await release_claim(req, key, claim_id)
+        if not await user_exists(req.user_id):
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=400, detail="Insufficient balance or invalid amount")
+
+    response = {"message": f"Redeemed {req.amount} {req.token_type}", "remaining": user["balances"][req.token_type]}
+    # Record the outcome first: once debited, the key must never be claimable again.
+    # Any attempt may record it, as the keyed debit happened exactly once.
+    if key:
+        await async_transactions_col.update_one(
+            {"user_id": req.user_id, "idempotency_key": key, "status": "pending"},
+            {"$set": {"status": "completed", "response": response}, "$unset": {"claim_expires_at": ""}}
+        )
+        if not debited:
+            return response
+    else:
+        await async_transactions_col.insert_one({
             "user_id": req.user_id,
             "action": "redeem",
             "token": req.token_type,
             "amount": float(req.amount),
             "timestamp": now_utc()
         })
-        return {"message": f"Redeemed {req.amount} {req.token_type}", "remaining": bal - req.amount}
-    else:
-        raise HTTPException(status_code=400, detail="Insufficient balance or invalid amount")
+    await bump_system_stats(total_actions=1)
+    return response
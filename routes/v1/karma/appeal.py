@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
-from database import users_col
+from utils.user_repository import user_exists
 from utils.paap import classify_paap_action
-from utils.atonement import create_atonement_plan
+from utils.atonement import create_atonement_plan, get_atonement_plan_page, iter_atonement_plans, decode_plan_cursor
+from utils.responses import MongoJSONResponse, ndjson_lines
+from config import ATONEMENT_PAGE_SIZE, ATONEMENT_MAX_PAGE_SIZE
 
 router = APIRouter()
 
@@ -18,8 +21,7 @@ async def appeal_karma(request: AppealRequest):
     User requests review of a Paap action and receives a prescribed prāyaśchitta plan.
     """
     # Check if user exists
-    user = users_col.find_one({"user_id": request.user_id})
-    if not user:
+    if not await user_exists(request.user_id):
         raise HTTPException(status_code=404, detail="User not found")
     
     # Classify the action to determine Paap severity
@@ -28,7 +30,7 @@ async def appeal_karma(request: AppealRequest):
         raise HTTPException(status_code=400, detail="Action does not qualify for appeal")
     
     # Create an atonement plan
-    plan = create_atonement_plan(request.user_id, request.action, severity_class)
+    plan = await create_atonement_plan(request.user_id, request.action, severity_class)
     if not plan:
         raise HTTPException(status_code=500, detail="Failed to create atonement plan")
     
@@ -39,16 +41,40 @@ async def appeal_karma(request: AppealRequest):
     }
 
 @router.get("/status/{user_id}")
-async def appeal_status(user_id: str):
+async def appeal_status(
+    user_id: str,
+    status: Optional[str] = Query(None, pattern="^(pending|completed)$"),
+    limit: Optional[int] = Query(None, ge=1, le=ATONEMENT_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
     """
     Shows open appeals and progress for a user.
+
+    Plans are paginated oldest first and split into pending and completed; pass
+    ``next_cursor`` back as ``cursor`` for the following page, or ``status`` to
+    list only one kind. ``format=ndjson`` streams the plans one per line instead.
     """
-    from utils.atonement import get_user_atonement_plans
-    
-    plans = get_user_atonement_plans(user_id)
+    if cursor:
+        try:
+            decode_plan_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "ndjson":
+        return StreamingResponse(
+            ndjson_lines(iter_atonement_plans(user_id, status, cursor, limit)),
+            media_type="application/x-ndjson"
+        )
+
+    plans, next_cursor = await get_atonement_plan_page(user_id, status, cursor, limit or ATONEMENT_PAGE_SIZE)
+    plans_by_status = {"pending": [], "completed": []}
+    for plan in plans:
+        plans_by_status.setdefault(plan["status"], []).append(plan)
     
-    return {
+    return MongoJSONResponse({
         "status": "success",
-        "pending_plans": [p for p in plans if p["status"] == "pending"],
-        "completed_plans": [p for p in plans if p["status"] == "completed"]
-    }
\ No newline at end of file
+        "pending_plans": plans_by_status["pending"],
+        "completed_plans": plans_by_status["completed"],
+        "next_cursor": next_cursor
+    })
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime, timezone
-from utils.atonement import validate_atonement_proof, get_user_atonement_plans
+from utils.atonement import validate_atonement_proof, get_atonement_plan_page, iter_atonement_plans, decode_plan_cursor
+from utils.responses import MongoJSONResponse, ndjson_lines
+from config import ATONEMENT_PAGE_SIZE, ATONEMENT_MAX_PAGE_SIZE
 
 router = APIRouter()
 
@@ -20,7 +23,7 @@ async def submit_atonement(submission: AtonementSubmission):
     Submit proof for completion of an atonement task.
     """
     # Validate the submission
-    success, message, updated_plan = validate_atonement_proof(
+    success, message, updated_plan = await validate_atonement_proof(
         submission.plan_id,
         submission.atonement_type,
         submission.amount,
@@ -64,7 +67,7 @@ async def submit_atonement_with_file(
         proof_text = f"{proof_text or ''}\nFile reference: {file_reference}"
     
     # Validate the submission
-    success, message, updated_plan = validate_atonement_proof(
+    success, message, updated_plan = await validate_atonement_proof(
         plan_id,
         atonement_type,
         amount,
@@ -82,14 +85,37 @@ async def submit_atonement_with_file(
     }
 
 @router.get("/plans/{user_id}")
-async def get_atonement_plans(user_id: str):
+async def get_atonement_plans(
+    user_id: str,
+    status: Optional[str] = Query(None, pattern="^(pending|completed)$"),
+    limit: Optional[int] = Query(None, ge=1, le=ATONEMENT_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
     """
-    Get all atonement plans for a user.
+    Get a user's atonement plans, oldest first, one page at a time.
+
+    Pass ``next_cursor`` back as ``cursor`` for the following page. With
+    ``format=ndjson`` every matching plan after ``cursor`` (up to ``limit``) is
+    streamed one per line instead.
     """
-    plans = get_user_atonement_plans(user_id)
+    if cursor:
+        try:
+            decode_plan_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "ndjson":
+        return StreamingResponse(
+            ndjson_lines(iter_atonement_plans(user_id, status, cursor, limit)),
+            media_type="application/x-ndjson"
+        )
+
+    plans, next_cursor = await get_atonement_plan_page(user_id, status, cursor, limit or ATONEMENT_PAGE_SIZE)
     
-    return {
+    return MongoJSONResponse({
         "status": "success",
         "user_id": user_id,
-        "plans": plans
-    }
\ No newline at end of file
+        "plans": plans,
+        "next_cursor": next_cursor
+    })
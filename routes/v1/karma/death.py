@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from datetime import datetime, timezone
-from database import users_col, death_events_col
+from database import async_death_events_col
+from utils.user_repository import get_user, PROFILE
 from utils.loka import compute_loka_assignment, create_rebirth_carryover, apply_rebirth
 
 router = APIRouter()
@@ -16,7 +17,7 @@ async def death_event(request: DeathEventRequest):
     Stores the death event in the database for record keeping.
     """
     # Check if user exists
-    user = users_col.find_one({"user_id": request.user_id})
+    user = await get_user(request.user_id, PROFILE)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -57,7 +58,7 @@ async def death_event(request: DeathEventRequest):
         "status": "completed"
     }
     
-    death_events_col.insert_one(death_event_doc)
+    await async_death_events_col.insert_one(death_event_doc)
     
     return {
         "status": "success",
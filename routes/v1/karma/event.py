@@ -1,12 +1,21 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Header, Query, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, ValidationError
 from typing import Optional, Dict, Any, Union
-from datetime import datetime
+from datetime import datetime, timedelta
+import asyncio
+import json
+import logging
 import uuid
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 # Import database and models
-from database import karma_events_col
+from database import async_karma_events_col
 from models import KarmaEvent
+from utils.event_queue import AVAILABLE, notify_enqueued
+from utils.gateway_metrics import gateway_metrics
+from config import EVENT_BATCH_MAX_SIZE, EVENT_BATCH_CONCURRENCY, EVENT_PROCESSING_MODE, EVENT_SYNC_LEASE_SECONDS
 
 # Import internal route handlers
 from routes.v1.karma.log_action import log_action, LogActionRequest
@@ -16,12 +25,14 @@ from routes.v1.karma.death import death_event, DeathEventRequest
 from routes.v1.karma.stats import get_user_stats
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class UnifiedEventRequest(BaseModel):
     type: str = Field(..., description="Event type: life_event, atonement, appeal, death_event, stats_request")
     data: Dict[str, Any] = Field(..., description="Event-specific data payload")
     timestamp: Optional[datetime] = None
     source: Optional[str] = Field(None, description="Source system or department")
+    idempotency_key: Optional[str] = Field(None, description="Client-chosen key; retries with the same key are processed once")
 
 class UnifiedEventResponse(BaseModel):
     status: str
@@ -31,8 +42,146 @@ class UnifiedEventResponse(BaseModel):
     timestamp: datetime
     routing_info: Dict[str, Any]
 
+def _lease_to_request(db_event: KarmaEvent):
+    """
+    Lease ``db_event`` to the request about to process it.
+
+    Until the lease expires queue workers leave the event alone; afterwards it
+    counts as abandoned and a worker or a retry with the same key takes it over.
+    """
+    db_event.lease_expires_at = datetime.utcnow() + timedelta(seconds=EVENT_SYNC_LEASE_SECONDS)
+    # Batch items share their batch's claim so its leases can be renewed together
+    db_event.claimed_by = db_event.claimed_by or f"request:{db_event.event_id}"
+    db_event.attempts = 1
+
+async def _claim_idempotency_key(db_event: KarmaEvent):
+    """
+    Store ``db_event`` as pending under its idempotency key, leased to this request.
+
+    A key whose earlier attempt failed, or whose pending attempt's lease has
+    expired, is re-claimed for this attempt.
+
+    Returns:
+        dict: None if this request now owns the key, otherwise the stored event
+    """
+    _lease_to_request(db_event)
+    try:
+        await async_karma_events_col.insert_one(db_event.dict())
+        return None
+    except DuplicateKeyError:
+        pass
+    now = datetime.utcnow()
+    retried = await async_karma_events_col.find_one_and_update(
+        {"idempotency_key": db_event.idempotency_key, "$or": [
+            {"status": "failed"},
+            # Claims from before sync leases existed have none and were abandoned
+            {"status": "pending", "lease_expires_at": None},
+            {"status": "pending", "lease_expires_at": {"$lte": now}}
+        ]},
+        {
+            "$set": {
+                "event_id": db_event.event_id,
+                "status": "pending",
+                "error_message": None,
+                "lease_expires_at": db_event.lease_expires_at,
+                "claimed_by": db_event.claimed_by,
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        }
+    )
+    if retried:
+        return None
+    return await async_karma_events_col.find_one({"idempotency_key": db_event.idempotency_key}, {"_id": 0})
+
+def _final_state(db_event: KarmaEvent):
+    """Update that records the outcome of a leased event and releases its lease."""
+    return {
+        "$set": {
+            "status": db_event.status,
+            "response_data": db_event.response_data,
+            "error_message": db_event.error_message,
+            "updated_at": db_event.updated_at
+        },
+        "$unset": {"lease_expires_at": ""}
+    }
+
+async def _record_event(db_event: KarmaEvent, claimed: bool):
+    """Persist the final state of ``db_event``, updating its pending record if one was claimed."""
+    if claimed:
+        # A no-op if the lease expired and a worker or a retry took the event over
+        await async_karma_events_col.update_one(
+            {"event_id": db_event.event_id, "claimed_by": db_event.claimed_by},
+            _final_state(db_event)
+        )
+    else:
+        await async_karma_events_col.insert_one(db_event.dict())
+
+async def _enqueue(db_event: KarmaEvent):
+    """
+    Store ``db_event`` as pending for the queue workers and acknowledge it with a 202.
+
+    A repeated idempotency key returns the stored response once processed, the
+    queued event while it is pending, and re-queues the event if it failed.
+    """
+    db_event.lease_expires_at = AVAILABLE
+    try:
+        await async_karma_events_col.insert_one(db_event.dict())
+    except DuplicateKeyError:
+        previous = await async_karma_events_col.find_one_and_update(
+            {"idempotency_key": db_event.idempotency_key, "status": "failed"},
+            {"$set": {
+                "event_id": db_event.event_id,
+                "status": "pending",
+                "error_message": None,
+                "lease_expires_at": AVAILABLE,
+                "attempts": 0,
+                "updated_at": datetime.utcnow()
+            }},
+            return_document=ReturnDocument.AFTER
+        ) or await async_karma_events_col.find_one({"idempotency_key": db_event.idempotency_key}, {"_id": 0})
+        if previous["status"] == "processed":
+            return UnifiedEventResponse(**previous["response_data"])
+        db_event.event_id = previous["event_id"]
+    notify_enqueued()
+    return JSONResponse(status_code=202, content={
+        "status": "accepted",
+        "event_id": db_event.event_id,
+        "event_type": db_event.event_type,
+        "status_url": f"/v1/karma/event/{db_event.event_id}"
+    })
+
+async def process_queued_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run a claimed queue event through its handler; used by the event queue workers.
+
+    Events failing with a 5xx are flagged ``retryable`` so the worker puts them
+    back on the queue instead of recording the failure as final.
+    """
+    request = UnifiedEventRequest(
+        type=event["event_type"],
+        data=event["data"],
+        timestamp=event["timestamp"],
+        source=event.get("source"),
+        idempotency_key=event.get("idempotency_key")
+    )
+    db_event = KarmaEvent(**event)
+    result = await _execute(request, db_event)
+    return {
+        **event,
+        "status": db_event.status,
+        "response_data": db_event.response_data,
+        "error_message": db_event.error_message,
+        # Server errors (e.g. the database being unreachable) may pass; client errors will not
+        "retryable": result["status_code"] >= 500
+    }
+
 @router.post("/", response_model=UnifiedEventResponse)
-async def unified_event_endpoint(request: UnifiedEventRequest):
+async def unified_event_endpoint(
+    request: UnifiedEventRequest,
+    idempotency_key: Optional[str] = Header(None),
+    mode: Optional[str] = Query(None, description="'sync' (default) or 'async' to enqueue and answer 202")
+):
     """
     Unified event gateway that routes different event types to appropriate internal endpoints.
     Stores all events in karma_events collection for audit and debugging.
@@ -45,6 +194,14 @@ async def unified_event_endpoint(request: UnifiedEventRequest):
     - appeal: Request karma appeal (maps to /appeal)
     - death_event: Process user death (maps to /death/event)
     - stats_request: Get user statistics (maps to /stats)
+
+    Retries carrying the same idempotency key (``Idempotency-Key`` header or
+    ``idempotency_key`` field) return the stored response without re-running the
+    handler; a key whose first attempt failed may be retried.
+
+    In async mode (``?mode=async`` or EVENT_PROCESSING_MODE) the event is only
+    stored as pending and a 202 with its ``event_id`` is returned; queue workers
+    process it and its outcome is available from ``GET /v1/karma/event/{event_id}``.
     """
     # Generate unique event ID
     event_id = str(uuid.uuid4())
@@ -61,53 +218,67 @@ async def unified_event_endpoint(request: UnifiedEventRequest):
         timestamp=request.timestamp,
         source=request.source,
         status="pending",
+        idempotency_key=idempotency_key or request.idempotency_key,
         created_at=datetime.utcnow()
     )
+
+    if (mode or EVENT_PROCESSING_MODE) == "async":
+        if request.type not in EVENT_HANDLERS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid event type: {request.type}. Valid types: {', '.join(EVENT_HANDLERS)}"
+            )
+        return await _enqueue(db_event)
+
+    claimed = False
+    if db_event.idempotency_key:
+        previous = await _claim_idempotency_key(db_event)
+        if previous:
+            if previous.get("status") == "processed":
+                return UnifiedEventResponse(**previous["response_data"])
+            raise HTTPException(status_code=409, detail="An event with this idempotency key is still being processed")
+        claimed = True
     
     try:
-        # Route based on event type
-        if request.type == "life_event":
-            response = await _handle_life_event(request, event_id)
-        elif request.type == "atonement":
-            response = await _handle_atonement(request, event_id)
-        elif request.type == "appeal":
-            response = await _handle_appeal(request, event_id)
-        elif request.type == "death_event":
-            response = await _handle_death_event(request, event_id)
-        elif request.type == "stats_request":
-            response = await _handle_stats_request(request, event_id)
-        else:
+        handler = EVENT_HANDLERS.get(request.type)
+        if handler is None:
             # Update database with error
             db_event.status = "failed"
             db_event.error_message = f"Invalid event type: {request.type}"
-            karma_events_col.insert_one(db_event.dict())
+            db_event.updated_at = datetime.utcnow()
+            await _record_event(db_event, claimed)
             
             raise HTTPException(
                 status_code=400, 
-                detail=f"Invalid event type: {request.type}. Valid types: life_event, atonement, appeal, death_event, stats_request"
+                detail=f"Invalid event type: {request.type}. Valid types: {', '.join(EVENT_HANDLERS)}"
             )
+        async with gateway_metrics.track():
+            response = await handler(request, event_id)
         
         # Update database with success
         db_event.status = "processed"
         db_event.response_data = response.dict()
         db_event.updated_at = datetime.utcnow()
-        karma_events_col.insert_one(db_event.dict())
+        await _record_event(db_event, claimed)
         
         return response
         
     except HTTPException as e:
+        if db_event.status == "failed":
+            raise
         # Update database with HTTP error
         db_event.status = "failed"
         db_event.error_message = str(e)
         db_event.updated_at = datetime.utcnow()
-        karma_events_col.insert_one(db_event.dict())
+        await _record_event(db_event, claimed)
         raise
     except Exception as e:
+        logger.exception("Error processing event %s", event_id)
         # Update database with unexpected error
         db_event.status = "failed"
         db_event.error_message = f"Internal error: {str(e)}"
         db_event.updated_at = datetime.utcnow()
-        karma_events_col.insert_one(db_event.dict())
+        await _record_event(db_event, claimed)
         
         raise HTTPException(
             status_code=500, 
@@ -132,7 +303,7 @@ async def _handle_life_event(request: UnifiedEventRequest, event_id: str) -> Uni
         )
         
         # Call internal endpoint
-        result = log_action(log_request)
+        result = await log_action(log_request)
         
         return UnifiedEventResponse(
             status="success",
@@ -149,6 +320,7 @@ async def _handle_life_event(request: UnifiedEventRequest, event_id: str) -> Uni
     except HTTPException:
         raise
     except Exception as e:
+        logger.exception("Error processing life_event event %s", event_id)
         raise HTTPException(status_code=500, detail=f"Error processing life_event: {str(e)}")
 
 async def _handle_atonement(request: UnifiedEventRequest, event_id: str) -> UnifiedEventResponse:
@@ -188,6 +360,7 @@ async def _handle_atonement(request: UnifiedEventRequest, event_id: str) -> Unif
     except HTTPException:
         raise
     except Exception as e:
+        logger.exception("Error processing atonement event %s", event_id)
         raise HTTPException(status_code=500, detail=f"Error processing atonement: {str(e)}")
 
 async def _handle_appeal(request: UnifiedEventRequest, event_id: str) -> UnifiedEventResponse:
@@ -222,6 +395,7 @@ async def _handle_appeal(request: UnifiedEventRequest, event_id: str) -> Unified
     except HTTPException:
         raise
     except Exception as e:
+        logger.exception("Error processing appeal event %s", event_id)
         raise HTTPException(status_code=500, detail=f"Error processing appeal: {str(e)}")
 
 async def _handle_death_event(request: UnifiedEventRequest, event_id: str) -> UnifiedEventResponse:
@@ -254,6 +428,7 @@ async def _handle_death_event(request: UnifiedEventRequest, event_id: str) -> Un
     except HTTPException:
         raise
     except Exception as e:
+        logger.exception("Error processing death_event event %s", event_id)
         raise HTTPException(status_code=500, detail=f"Error processing death_event: {str(e)}")
 
 async def _handle_stats_request(request: UnifiedEventRequest, event_id: str) -> UnifiedEventResponse:
@@ -281,8 +456,227 @@ async def _handle_stats_request(request: UnifiedEventRequest, event_id: str) ->
     except HTTPException:
         raise
     except Exception as e:
+        logger.exception("Error processing stats_request event %s", event_id)
         raise HTTPException(status_code=500, detail=f"Error processing stats_request: {str(e)}")
 
+EVENT_HANDLERS = {
+    "life_event": _handle_life_event,
+    "atonement": _handle_atonement,
+    "appeal": _handle_appeal,
+    "death_event": _handle_death_event,
+    "stats_request": _handle_stats_request
+}
+
+async def _execute(request: UnifiedEventRequest, db_event: KarmaEvent):
+    """
+    Run the handler for one batched event and record the outcome on ``db_event``.
+
+    Returns:
+        dict: The per-item result reported by the batch endpoint
+    """
+    result = {"event_id": db_event.event_id}
+    try:
+        handler = EVENT_HANDLERS.get(request.type)
+        if handler is None:
+            raise HTTPException(status_code=400, detail=f"Invalid event type: {request.type}")
+        async with gateway_metrics.track():
+            response = await handler(request, db_event.event_id)
+        db_event.status = "processed"
+        db_event.response_data = response.dict()
+        result.update({"status": "processed", "status_code": 200, "response": db_event.response_data})
+    except HTTPException as e:
+        db_event.status = "failed"
+        db_event.error_message = str(e)
+        result.update({"status": "failed", "status_code": e.status_code, "error": e.detail})
+    except Exception as e:
+        logger.exception("Error processing event %s", db_event.event_id)
+        db_event.status = "failed"
+        db_event.error_message = f"Internal error: {str(e)}"
+        result.update({"status": "failed", "status_code": 500, "error": db_event.error_message})
+    db_event.updated_at = datetime.utcnow()
+    return result
+
+async def _parse_batch(http_request: Request):
+    """Read a batch body given as a JSON array or as NDJSON (one event per line)."""
+    body = await http_request.body()
+    try:
+        if "ndjson" in http_request.headers.get("content-type", ""):
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed batch body: {str(e)}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Batch body must be a JSON array or NDJSON")
+    if len(items) > EVENT_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {EVENT_BATCH_MAX_SIZE} events")
+    return items
+
+async def _record_finished(finished):
+    """Write the final states of the batch events in ``finished`` in one bulk_write, emptying it."""
+    if not finished:
+        return
+    # Take the events before awaiting, so ones finishing meanwhile wait for the next write
+    batch = finished[:]
+    del finished[:]
+    await async_karma_events_col.bulk_write([
+        UpdateOne({"event_id": event.event_id, "claimed_by": event.claimed_by}, _final_state(event))
+        for event in batch
+    ], ordered=False)
+
+async def _hold_batch_leases(claimed_by, finished, done):
+    """
+    Keep a running batch's events leased until ``done`` is set.
+
+    Every third of EVENT_SYNC_LEASE_SECONDS the events finished so far are
+    recorded and the leases of those still pending are renewed, so a long batch
+    never lets queue workers take over events it has processed or has yet to reach.
+    """
+    while True:
+        try:
+            await asyncio.wait_for(done.wait(), timeout=EVENT_SYNC_LEASE_SECONDS / 3)
+            return
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await _record_finished(finished)
+            await async_karma_events_col.update_many(
+                {"status": "pending", "claimed_by": claimed_by},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=EVENT_SYNC_LEASE_SECONDS)}}
+            )
+        except Exception:
+            logger.exception("Error renewing leases of batch %s", claimed_by)
+
+@router.post("/batch")
+async def unified_event_batch(http_request: Request):
+    """
+    Bulk version of the unified gateway.
+
+    Accepts a JSON array of events, or NDJSON with ``Content-Type: application/x-ndjson``,
+    each shaped like a single-event request. Events go through the same handlers;
+    one user's events are processed in order and different users' concurrently.
+    The karma_events records of the whole batch are inserted with one insert_many;
+    final states are written with bulk_writes of the events finished so far, while
+    the leases of the rest are renewed. Idempotency keys behave as for the single endpoint.
+
+    Returns one result per input event, in input order, with its own status code.
+    """
+    items = await _parse_batch(http_request)
+    batch_claim = f"batch:{uuid.uuid4()}"
+    results = [None] * len(items)
+    requests = {}
+    events = {}
+    first_with_key = {}
+    repeats = {}
+
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = {"status": "failed", "status_code": 422, "error": "Each event must be a JSON object"}
+            continue
+        try:
+            request = UnifiedEventRequest(**item)
+        except ValidationError as e:
+            results[i] = {"status": "failed", "status_code": 422, "error": str(e)}
+            continue
+        if not request.timestamp:
+            request.timestamp = datetime.utcnow()
+        key = request.idempotency_key
+        if key in first_with_key:
+            # Same key twice in one batch: the later item shares the first one's result
+            repeats[i] = first_with_key[key]
+            continue
+        if key:
+            first_with_key[key] = i
+        requests[i] = request
+        events[i] = KarmaEvent(
+            event_id=str(uuid.uuid4()),
+            event_type=request.type,
+            data=request.data,
+            timestamp=request.timestamp,
+            source=request.source,
+            status="pending",
+            idempotency_key=key,
+            claimed_by=batch_claim,
+            created_at=datetime.utcnow()
+        )
+        _lease_to_request(events[i])
+
+    # Record every event as pending in one write; keys seen before fail the unique index
+    order = list(events)
+    duplicates = []
+    if order:
+        try:
+            await async_karma_events_col.insert_many([events[i].dict() for i in order], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != 11000:
+                    raise
+                duplicates.append(order[error["index"]])
+
+    if duplicates:
+        keys = [events[i].idempotency_key for i in duplicates]
+        stored = {doc["idempotency_key"]: doc async for doc in async_karma_events_col.find({"idempotency_key": {"$in": keys}}, {"_id": 0})}
+        for i in duplicates:
+            previous = stored.get(events[i].idempotency_key) or {}
+            if previous.get("status") == "processed":
+                results[i] = {"event_id": previous["event_id"], "status": "duplicate", "status_code": 200, "response": previous["response_data"]}
+            elif previous.get("status") and await _claim_idempotency_key(events[i]) is None:
+                # Failed earlier, or abandoned with an expired lease: processed in this batch
+                continue
+            else:
+                results[i] = {"event_id": previous.get("event_id"), "status": "failed", "status_code": 409,
+                              "error": "An event with this idempotency key is still being processed"}
+            del events[i]
+
+    by_user = {}
+    for i in events:
+        by_user.setdefault(str(requests[i].data.get("user_id")), []).append(i)
+    semaphore = asyncio.Semaphore(EVENT_BATCH_CONCURRENCY)
+
+    finished = []
+
+    async def run_user_events(indices):
+        async with semaphore:
+            for i in indices:
+                results[i] = await _execute(requests[i], events[i])
+                finished.append(events[i])
+
+    done = asyncio.Event()
+    lease_keeper = asyncio.create_task(_hold_batch_leases(batch_claim, finished, done))
+    try:
+        await asyncio.gather(*(run_user_events(indices) for indices in by_user.values()))
+    finally:
+        done.set()
+        await lease_keeper
+    await _record_finished(finished)
+
+    for i, first in repeats.items():
+        status = "duplicate" if results[first]["status"] == "processed" else results[first]["status"]
+        results[i] = {**results[first], "status": status}
+    for i, result in enumerate(results):
+        result["index"] = i
+
+    counts = {"processed": 0, "duplicate": 0, "failed": 0}
+    for result in results:
+        counts[result["status"]] += 1
+    return {"total": len(results), **counts, "results": results}
+
+@router.get("/metrics")
+async def get_gateway_metrics():
+    """Handlers in flight and event-loop lag for this worker process."""
+    return gateway_metrics.snapshot()
+
+@router.get("/{event_id}")
+async def get_event(event_id: str):
+    """Status of a gateway event, e.g. to poll an event accepted in async mode."""
+    event = await async_karma_events_col.find_one({"event_id": event_id}, {
+        "_id": 0, "event_id": 1, "event_type": 1, "status": 1, "response_data": 1,
+        "error_message": 1, "attempts": 1, "created_at": 1, "updated_at": 1
+    })
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return event
+
 # Additional endpoint for file-based atonement submissions
 @router.post("/with-file", response_model=UnifiedEventResponse)
 async def unified_event_with_file(
@@ -326,7 +720,7 @@ async def unified_event_with_file(
             # Update database with error
             db_event.status = "failed"
             db_event.error_message = "Currently only 'atonement_with_file' is supported for file uploads"
-            karma_events_col.insert_one(db_event.dict())
+            await async_karma_events_col.insert_one(db_event.dict())
             raise HTTPException(status_code=400, detail="Currently only 'atonement_with_file' is supported for file uploads")
         
         # Call the file-based atonement endpoint
@@ -344,7 +738,7 @@ async def unified_event_with_file(
         db_event.status = "processed"
         db_event.response_data = result
         db_event.updated_at = datetime.utcnow()
-        karma_events_col.insert_one(db_event.dict())
+        await async_karma_events_col.insert_one(db_event.dict())
         
         return UnifiedEventResponse(
             status="success",
@@ -363,12 +757,13 @@ async def unified_event_with_file(
         db_event.status = "failed"
         db_event.error_message = str(e)
         db_event.updated_at = datetime.utcnow()
-        karma_events_col.insert_one(db_event.dict())
+        await async_karma_events_col.insert_one(db_event.dict())
         raise
     except Exception as e:
+        logger.exception("Error processing event %s", event_id)
         # Update database with unexpected error
         db_event.status = "failed"
         db_event.error_message = f"Internal error: {str(e)}"
         db_event.updated_at = datetime.utcnow()
-        karma_events_col.insert_one(db_event.dict())
+        await async_karma_events_col.insert_one(db_event.dict())
         raise HTTPException(status_code=500, detail=f"Error processing {event_type}: {str(e)}")
\ No newline at end of file
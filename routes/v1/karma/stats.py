@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
-from database import users_col, transactions_col, atonements_col
-from utils.tokens import apply_decay_and_expiry
+from utils.user_repository import get_user, STATS
+from utils.stats_counters import get_user_counters, get_system_counters
+from utils.tokens import decay_for_read
 from utils.merit import compute_user_merit_score
 from utils.paap import get_total_paap_score
 from utils.loka import calculate_net_karma
@@ -13,25 +14,17 @@ async def get_user_stats(user_id: str):
     """
     Get comprehensive karma statistics for a user.
     """
-    user = users_col.find_one({"user_id": user_id})
+    user = await get_user(user_id, STATS)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user = apply_decay_and_expiry(user)
+    user = await decay_for_read(user)
     merit_score = compute_user_merit_score(user)
     paap_score = get_total_paap_score(user)
     net_karma = calculate_net_karma(user)
     
-    # Get action statistics
-    total_actions = transactions_col.count_documents({"user_id": user_id})
-    pending_atonements = atonements_col.count_documents({
-        "user_id": user_id, 
-        "status": "pending"
-    })
-    completed_atonements = atonements_col.count_documents({
-        "user_id": user_id, 
-        "status": "completed"
-    })
+    # Get action statistics, maintained as counters on the user document
+    action_stats = await get_user_counters(user)
     
     return {
         "status": "success",
@@ -41,11 +34,7 @@ async def get_user_stats(user_id: str):
         "paap_score": paap_score,
         "net_karma": net_karma,
         "balances": user.get("balances", {}),
-        "action_stats": {
-            "total_actions": total_actions,
-            "pending_atonements": pending_atonements,
-            "completed_atonements": completed_atonements
-        },
+        "action_stats": action_stats,
         "token_attributes": TOKEN_ATTRIBUTES
     }
 
@@ -54,15 +43,7 @@ async def get_system_stats():
     """
     Get system-wide karma statistics.
     """
-    total_users = users_col.count_documents({})
-    total_actions = transactions_col.count_documents({})
-    total_atonements = atonements_col.count_documents({})
-    
     return {
         "status": "success",
-        "system_stats": {
-            "total_users": total_users,
-            "total_actions": total_actions,
-            "total_atonements": total_atonements
-        }
+        "system_stats": await get_system_counters()
     }
\ No newline at end of file
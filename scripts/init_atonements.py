@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Create the indexes the atonements collection relies on, including the unique
+index on plan_id that backs collision-free plan IDs.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import atonements_col
+from pymongo import IndexModel, ASCENDING
+
+def init_atonement_indexes():
+    """Create atonements indexes"""
+
+    print("🚀 Ensuring atonements indexes...")
+
+    indexes = [
+        IndexModel([("plan_id", ASCENDING)], unique=True),
+        # Keyset pagination of plan listings, with and without a status filter
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)])
+    ]
+
+    try:
+        atonements_col.create_indexes(indexes)
+        print("✅ Indexes created successfully")
+
+        print("\n📋 Available indexes:")
+        for index in atonements_col.list_indexes():
+            print(f"  - {index['name']}: {index['key']}")
+        return True
+
+    except Exception as e:
+        # A duplicate plan_id left by the old count-based IDs makes the unique index fail
+        print(f"❌ Error creating indexes: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🛠️ Atonements Collection Setup")
+    print("=" * 40)
+
+    if init_atonement_indexes():
+        print("\n🎉 atonements collection is ready.")
+    else:
+        print("\n❌ Index creation failed.")
+        sys.exit(1)
@@ -19,10 +19,18 @@ def init_karma_events_collection():
     # Create indexes for efficient querying
     indexes = [
         IndexModel([("event_id", ASCENDING)], unique=True),
+        # Gateway retries are deduplicated by idempotency key; events without one are not indexed
+        IndexModel(
+            [("idempotency_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$type": "string"}}
+        ),
         IndexModel([("event_type", ASCENDING)]),
         IndexModel([("user_id", ASCENDING)]),  # If user_id exists in data
         IndexModel([("timestamp", DESCENDING)]),
         IndexModel([("status", ASCENDING)]),
+        # Queue workers claim the oldest pending event whose lease is free
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING), ("created_at", ASCENDING)]),
         IndexModel([("source", ASCENDING)]),
         IndexModel([("created_at", DESCENDING)])
     ]
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Create the indexes the transactions collection relies on, including the unique
+per-user index on idempotency_key that deduplicates redeem retries.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import transactions_col
+from pymongo import IndexModel, ASCENDING
+
+def init_transaction_indexes():
+    """Create transactions indexes"""
+
+    print("🚀 Ensuring transactions indexes...")
+
+    indexes = [
+        # Redeem retries are deduplicated per user by idempotency key; other entries are not indexed
+        IndexModel(
+            [("user_id", ASCENDING), ("idempotency_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$exists": True}}
+        )
+    ]
+
+    try:
+        transactions_col.create_indexes(indexes)
+        print("✅ Indexes created successfully")
+
+        print("\n📋 Available indexes:")
+        for index in transactions_col.list_indexes():
+            print(f"  - {index['name']}: {index['key']}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error creating indexes: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🛠️ Transactions Collection Setup")
+    print("=" * 40)
+
+    if init_transaction_indexes():
+        print("\n🎉 transactions collection is ready.")
+    else:
+        print("\n❌ Index creation failed.")
+        sys.exit(1)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Create the indexes the users collection relies on, including the unique index
+on user_id that keyset sweeps and every per-user lookup and update use.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import users_col
+from pymongo import IndexModel, ASCENDING
+
+def init_user_indexes():
+    """Create users indexes"""
+
+    print("🚀 Ensuring users indexes...")
+
+    indexes = [
+        IndexModel([("user_id", ASCENDING)], unique=True)
+    ]
+
+    try:
+        users_col.create_indexes(indexes)
+        print("✅ Indexes created successfully")
+
+        print("\n📋 Available indexes:")
+        for index in users_col.list_indexes():
+            print(f"  - {index['name']}: {index['key']}")
+        return True
+
+    except Exception as e:
+        # Duplicate user documents left by racing first actions make the unique index fail
+        print(f"❌ Error creating indexes: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🛠️ Users Collection Setup")
+    print("=" * 40)
+
+    if init_user_indexes():
+        print("\n🎉 users collection is ready.")
+    else:
+        print("\n❌ Index creation failed.")
+        sys.exit(1)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Recompute the materialized stats counters (users.stats and the system counters
+document) from the transactions, atonements and users collections, repairing
+any drift. Intended to run periodically (e.g. nightly from cron).
+"""
+
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.stats_counters import reconcile_stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile materialized stats counters")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Users per bulk_write batch")
+    args = parser.parse_args()
+
+    print("🛠️ Stats Reconciliation")
+    print("=" * 40)
+
+    try:
+        repaired, totals = reconcile_stats(args.batch_size)
+        print(f"✅ Repaired stats for {repaired} users")
+        print(f"📊 System totals: {totals}")
+        print("\n🎉 Reconciliation complete!")
+    except Exception as e:
+        print(f"\n❌ Reconciliation failed: {e}")
+        sys.exit(1)
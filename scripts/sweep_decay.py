@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Materialize token decay and expiry for every user, including idle ones.
+Intended to run periodically (e.g. nightly from cron); safe to interrupt and rerun.
+"""
+
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DECAY_SWEEP_BATCH_SIZE, DECAY_SWEEP_PAUSE_SECONDS
+from utils.decay_sweeper import sweep_decay
+from scripts.init_users import init_user_indexes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep decay and expiry across the users collection")
+    parser.add_argument("--batch-size", type=int, default=DECAY_SWEEP_BATCH_SIZE, help="Users per bulk_write batch")
+    parser.add_argument("--pause", type=float, default=DECAY_SWEEP_PAUSE_SECONDS, help="Seconds to sleep between batches")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint and start from the first user")
+    args = parser.parse_args()
+
+    print("🛠️ Decay Sweeper")
+    print("=" * 40)
+
+    # Keyset batches walk users by user_id; without the index every batch is a collection scan
+    if not init_user_indexes():
+        sys.exit(1)
+
+    try:
+        updated = sweep_decay(args.batch_size, args.pause, resume=not args.restart)
+        print(f"\n🎉 Sweep complete! {updated} users updated.")
+    except Exception as e:
+        print(f"\n❌ Sweep failed: {e}. Rerun to resume from the last checkpoint.")
+        sys.exit(1)
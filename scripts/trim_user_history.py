@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Trim the embedded users.history arrays down to USER_HISTORY_LIMIT entries and
+index transactions so the full ledger can be queried per user instead.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import users_col, transactions_col
+from config import USER_HISTORY_LIMIT
+from pymongo import IndexModel, ASCENDING, DESCENDING
+
+def ensure_transaction_indexes():
+    """Index transactions for per-user, newest-first history queries"""
+
+    print("🚀 Ensuring transactions indexes...")
+
+    try:
+        transactions_col.create_indexes([
+            IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)])
+        ])
+        print("✅ Indexes created successfully")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error creating indexes: {e}")
+        return False
+
+def trim_user_history(limit=USER_HISTORY_LIMIT):
+    """Keep only the newest ``limit`` entries of every oversized users.history array"""
+
+    print(f"✂️ Trimming users.history to the newest {limit} entries...")
+
+    try:
+        # Only users whose history has an element at index ``limit`` need trimming
+        result = users_col.update_many(
+            {f"history.{limit}": {"$exists": True}},
+            [{"$set": {"history": {"$slice": ["$history", -limit]}}}]
+        )
+        print(f"✅ Trimmed {result.modified_count} user documents")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error trimming history: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🛠️ User History Migration")
+    print("=" * 40)
+
+    if ensure_transaction_indexes() and trim_user_history():
+        print("\n🎉 Migration complete! users.history is now a capped ring.")
+    else:
+        print("\n❌ Migration failed.")
+        sys.exit(1)
@@ -0,0 +1,58 @@
+"""
+score_users must agree, row for row, with the scalar scoring helpers it replaces in bulk paths.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import MERIT_WEIGHTS, LEVEL_THRESHOLDS, LOKA_THRESHOLDS
+from utils.batch_scoring import PAAP_SEVERITIES, users_to_balance_array, score_users
+from utils.merit import compute_user_merit_score, determine_role_from_merit
+from utils.paap import get_total_paap_score
+from utils.loka import calculate_net_karma, compute_loka_assignment
+
+def _random_user(rng):
+    balances = {token: rng.choice([0, rng.randint(0, 800), rng.uniform(0, 400)]) for token in MERIT_WEIGHTS}
+    balances["PaapTokens"] = {severity: rng.choice([0, rng.randint(0, 60), rng.uniform(0, 150)]) for severity in PAAP_SEVERITIES}
+    return {"balances": balances}
+
+def _boundary_users():
+    """Users whose merit or net karma lands exactly on a configured threshold."""
+    users = [{"balances": {"DharmaPoints": float(t), "PaapTokens": {}}} for t in LEVEL_THRESHOLDS.values()]
+    for threshold in LOKA_THRESHOLDS.values():
+        for bound in (threshold["min_karma"], threshold["max_karma"]):
+            if abs(bound) != float("inf"):
+                users.append({"balances": {"DharmaPoints": max(bound, 0), "PaapTokens": {"minor": max(-bound, 0)}}})
+    # Gap between Antarloka (max -1) and Mrityuloka (min 0)
+    users.append({"balances": {"DharmaPoints": 0.5, "PaapTokens": {"minor": 1.0}}})
+    return users
+
+def _assert_matches_scalar(users):
+    scores = score_users(users_to_balance_array(users))
+    assert len(scores) == len(users)
+    for user, row in zip(users, scores):
+        merit = compute_user_merit_score(user)
+        assert row["merit"] == pytest.approx(merit)
+        assert row["paap_score"] == pytest.approx(get_total_paap_score(user))
+        assert row["net_karma"] == pytest.approx(calculate_net_karma(user))
+        assert row["role"] == determine_role_from_merit(merit)
+        assert row["loka"] == compute_loka_assignment(user)[0]
+
+def test_score_users_matches_scalar_functions():
+    rng = random.Random(20241017)
+    _assert_matches_scalar([_random_user(rng) for _ in range(500)])
+
+def test_score_users_matches_scalar_functions_on_boundaries():
+    _assert_matches_scalar(_boundary_users())
+
+def test_scalar_and_batch_scoring_share_configured_weights(monkeypatch):
+    monkeypatch.setitem(MERIT_WEIGHTS, "SevaPoints", 2.0)
+    user = {"balances": {"DharmaPoints": 10, "SevaPoints": 10, "PunyaTokens": 0, "PaapTokens": {}}}
+
+    assert calculate_net_karma(user) == pytest.approx(30.0)
+    _assert_matches_scalar([user])
@@ -0,0 +1,76 @@
+"""
+Batched Q updates must stay consistent with applying the same transitions one at a time.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import ALPHA, GAMMA
+from utils.qtable import QTable
+
+N_STATES, N_ACTIONS = 4, 5
+
+def _batch(transitions):
+    s, a, rewards, next_states = zip(*transitions)
+    return np.array(s), np.array(a), np.array(rewards, dtype=float), np.array(next_states)
+
+def test_batch_of_distinct_cells_matches_sequential_updates():
+    # No transition reads a row that another one in the batch writes
+    transitions = [(0, 1, 2.0, 3), (0, 4, -1.0, 3), (1, 2, 5.0, 2), (1, 0, 0.5, 3)]
+    sequential = QTable(N_STATES, N_ACTIONS)
+    sequential.values[2:] = np.arange(2 * N_ACTIONS).reshape(2, N_ACTIONS)
+    batched = QTable(N_STATES, N_ACTIONS)
+    batched.values = sequential.values.copy()
+
+    for transition in transitions:
+        sequential.update(*transition)
+    batched.apply_batch(*_batch(transitions))
+
+    np.testing.assert_allclose(batched.values, sequential.values)
+    np.testing.assert_array_equal(batched.visits, sequential.visits)
+
+def test_repeated_transitions_do_not_overshoot_sequential_updates():
+    transition = (0, 2, 10.0, 3)
+    sequential = QTable(N_STATES, N_ACTIONS)
+    batched = QTable(N_STATES, N_ACTIONS)
+
+    for _ in range(200):
+        sequential.update(*transition)
+    applied = batched.apply_batch(*_batch([transition] * 200))
+
+    target = 10.0  # Row 3 stays zero, so the TD target is the reward alone
+    assert applied == 200
+    assert sequential.values[0, 2] == pytest.approx(target)
+    # One step towards the target, however many times the cell repeats
+    assert batched.values[0, 2] == pytest.approx(ALPHA * target)
+    assert batched.visits[0, 2] == 200
+    assert batched.generation == sequential.generation == 200
+
+def test_repeated_batches_converge_like_sequential_updates():
+    # A self-loop, where summing 200 deltas per batch would diverge
+    transition = (1, 3, 1.0, 1)
+    fixed_point = 1.0 / (1 - GAMMA)
+    sequential = QTable(N_STATES, N_ACTIONS)
+    batched = QTable(N_STATES, N_ACTIONS)
+
+    for _ in range(2000):
+        sequential.update(*transition)
+    # Each batch contracts the gap to the fixed point by ALPHA * (1 - GAMMA)
+    for _ in range(1000):
+        batched.apply_batch(*_batch([transition] * 200))
+        assert 0.0 <= batched.values[1, 3] <= fixed_point + 1e-9
+
+    assert sequential.values[1, 3] == pytest.approx(fixed_point, rel=1e-3)
+    assert batched.values[1, 3] == pytest.approx(sequential.values[1, 3], rel=1e-3)
+
+def test_batch_deltas_are_tracked_for_delta_sync():
+    table = QTable(N_STATES, N_ACTIONS, sync_mode="delta")
+    table.apply_batch(*_batch([(2, 1, 4.0, 0), (2, 1, 2.0, 0), (3, 0, 1.0, 0)]))
+
+    np.testing.assert_allclose(table._deltas, table.values)
+    assert table.values[2, 1] == pytest.approx(ALPHA * 3.0)
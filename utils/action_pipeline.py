@@ -0,0 +1,161 @@
+from datetime import timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from database import async_users_col, async_transactions_col
+from config import INTENT_MAP, REWARD_MAP, CHEAT_PUNISHMENT_LEVELS, CHEAT_PUNISHMENT_RESET_DAYS, USER_OPTIMISTIC_CONCURRENCY, USER_WRITE_MAX_RETRIES
+from utils.tokens import compute_decay_and_expiry, now_utc
+from utils.merit import compute_user_merit_score, determine_role_from_merit
+from utils.transactions import build_transaction, history_push
+from utils.qlearning import plan_q_transition, get_q_table
+from utils.utils_user import create_user_if_missing
+from utils.user_repository import get_user, ACTION_STATE, ROLE_BALANCES
+from utils.paap import apply_paap_tokens
+from utils.atonement import create_atonement_plan
+from utils.user_locks import user_locks
+from utils.stats_counters import user_stats_inc, bump_system_stats
+from utils.decay_sweeper import SWEPT_TOKENS
+
+class ConcurrentUpdateError(Exception):
+    """The user document kept changing underneath the pipeline (optimistic concurrency)."""
+
+async def run_action_pipeline(user_id, role, action, note=None):
+    """
+    Process a karma action with a single read and a single write of the user document.
+
+    Decay, reward or punishment, Paap, merit and role are all computed in memory
+    from one fetch of the user, then committed with one find_one_and_update that
+    also appends the ledger entry to the user's history.
+
+    Balance changes are written as ``$inc`` deltas, so debits and rewards from other
+    writers that land between the read and the write are kept. The decay fields are
+    only written if ``last_decay`` still holds the value that was read; otherwise
+    decay was materialized meanwhile and the action is recomputed from a fresh read.
+
+    Actions for the same user are serialized within this process, together with
+    the user's other balance writers, so concurrent cheats cannot both read the
+    same cheat_history. With USER_OPTIMISTIC_CONCURRENCY
+    the write is also conditional on the document's ``version``, which guards against
+    other processes; on a conflict the action is recomputed from a fresh read.
+
+    Args:
+        user_id (str): The user's ID
+        role (str): The user's current role (Q-learning state)
+        action (str): The action being logged
+        note (str, optional): Free-text note; "auto_appeal" creates an atonement plan
+
+    Returns:
+        dict: Outcome of the action, including the post-image of the user document
+
+    Raises:
+        ConcurrentUpdateError: If every attempt lost an optimistic concurrency race
+    """
+    async with user_locks.hold(user_id):
+        for _ in range(USER_WRITE_MAX_RETRIES + 1):
+            outcome = await _apply_action(user_id, role, action)
+            if outcome is not None:
+                break
+        else:
+            raise ConcurrentUpdateError(f"User {user_id} was modified concurrently")
+
+    if outcome.get("paap_severity") and note and "auto_appeal" in note.lower():
+        await create_atonement_plan(user_id, action, outcome["paap_severity"])
+    return outcome
+
+async def _apply_action(user_id, role, action):
+    """One read-compute-write attempt; returns None if the last_decay or version check failed."""
+    user = await get_user(user_id, ACTION_STATE)
+    if not user:
+        user = await create_user_if_missing(user_id, role, ACTION_STATE)
+
+    version = user.get("version")
+    read_last_decay = user.get("last_decay")
+    read_balances = {t: user["balances"].get(t, 0) for t in SWEPT_TOKENS}
+    user = compute_decay_and_expiry(user)
+    balances = user["balances"]
+    outcome = {}
+    updates = {}
+
+    if action == "cheat":
+        current_time = now_utc()
+        reset_period = timedelta(days=CHEAT_PUNISHMENT_RESET_DAYS)
+
+        # Filter out old cheat attempts beyond the reset period
+        recent_cheats = [ch for ch in user.get("cheat_history", []) if current_time - ch["timestamp"] <= reset_period]
+        cheat_level = len(recent_cheats) + 1
+
+        punishment = CHEAT_PUNISHMENT_LEVELS.get(cheat_level, CHEAT_PUNISHMENT_LEVELS["default"])
+        reward_value = punishment["value"]
+        token = punishment["token"]
+        punishment_name = punishment["name"]
+        recent_cheats.append({"timestamp": current_time, "punishment_level": cheat_level, "value": reward_value})
+
+        transition, predicted_next_role = plan_q_transition(role, action, reward_value, balances)
+
+        reward_tier = "penalty"
+        updates["cheat_history"] = recent_cheats
+        outcome.update({
+            "cheat_level": cheat_level,
+            "cheats_in_period": len(recent_cheats),
+            "punishment_name": punishment_name
+        })
+    else:
+        reward_value = REWARD_MAP[action]["value"]
+        transition, predicted_next_role = plan_q_transition(role, action, reward_value, balances)
+        token = REWARD_MAP[action]["token"]
+        punishment_name = None
+        reward_tier = "high" if token == "PunyaTokens" else "medium" if token == "SevaPoints" else "low"
+
+        user, paap_severity, paap_value = apply_paap_tokens(user, action)
+        outcome.update({"paap_severity": paap_severity, "paap_value": paap_value})
+
+    # Decay and expiry become deltas against the balances that were read
+    increments = {f"balances.{t}": balances.get(t, 0) - read_balances[t] for t in SWEPT_TOKENS}
+    increments[f"balances.{token}"] += reward_value
+    if outcome.get("paap_severity"):
+        increments[f"balances.PaapTokens.{outcome['paap_severity']}"] = outcome["paap_value"]
+    increments = {path: amount for path, amount in increments.items() if amount}
+
+    balances[token] = balances.get(token, 0) + reward_value
+    merit_score = compute_user_merit_score(user)
+    new_role = determine_role_from_merit(merit_score)
+
+    tx = build_transaction(user_id, action, reward_value, INTENT_MAP[action], reward_tier, punishment_name)
+    # The history entry carries the ledger _id, which is only inserted once the user write commits
+    tx["_id"] = ObjectId()
+    updates.update({
+        "token_meta": user.get("token_meta", {}),
+        "last_decay": user["last_decay"],
+        "role": new_role
+    })
+    # The decay deltas are only valid if nobody materialized decay since the read;
+    # None also matches documents that were never decayed
+    query = {"user_id": user_id, "last_decay": read_last_decay}
+    if USER_OPTIMISTIC_CONCURRENCY:
+        # None also matches documents written before versioning
+        query["version"] = version
+    # Commit every user change in one round trip
+    user_after = await async_users_col.find_one_and_update(
+        query,
+        {"$set": updates, "$push": history_push(tx), "$inc": {**increments, "version": 1, **user_stats_inc(total_actions=1)}},
+        projection=ROLE_BALANCES,
+        return_document=ReturnDocument.AFTER
+    )
+    if user_after is None:
+        return None
+
+    # Side effects only once the write has committed, so a retried attempt cannot repeat them
+    await async_transactions_col.insert_one(tx)
+    await bump_system_stats(total_actions=1)
+    if transition:
+        get_q_table().learn(*transition)
+
+    outcome.update({
+        "user": user_after,
+        "token": token,
+        "reward_value": reward_value,
+        "reward_tier": reward_tier,
+        "predicted_next_role": predicted_next_role,
+        "new_role": new_role,
+        "merit_score": merit_score
+    })
+    return outcome
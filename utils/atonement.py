@@ -1,20 +1,19 @@
-from datetime import datetime, timezone
-from config import PRAYASCHITTA_MAP, ATONEMENT_REWARDS
-from database import users_col, transactions_col, appeals_col, atonements_col
+import asyncio
+import base64
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId
+from config import PRAYASCHITTA_MAP, ATONEMENT_REWARDS, ATONEMENT_PAGE_SIZE, ATONEMENT_MAX_PAGE_SIZE
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import async_users_col, async_transactions_col, async_appeals_col, async_atonements_col
+from utils.user_repository import user_exists
 from utils.qlearning import atonement_q_learning_step
 from utils.merit import compute_user_merit_score, determine_role_from_merit
+from utils.stats_counters import bump_user_stats, bump_system_stats
 
-def serialize_mongodb_doc(doc):
-    """Helper function to serialize MongoDB documents"""
-    if isinstance(doc, dict):
-        return {k: serialize_mongodb_doc(v) for k, v in doc.items()}
-    elif isinstance(doc, list):
-        return [serialize_mongodb_doc(item) for item in doc]
-    elif isinstance(doc, ObjectId):
-        return str(doc)
-    else:
-        return doc
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Keyset order for plan listings; ties on created_at are broken by _id
+PLAN_ORDER = [("created_at", 1), ("_id", 1)]
 
 def get_prescribed_atonement(severity_class):
     """
@@ -31,7 +30,7 @@ def get_prescribed_atonement(severity_class):
     
     return PRAYASCHITTA_MAP[severity_class]
 
-def create_atonement_plan(user_id, paap_action, severity_class):
+async def create_atonement_plan(user_id, paap_action, severity_class):
     """
     Create an atonement plan for a user based on a Paap action.
     
@@ -64,15 +63,11 @@ def create_atonement_plan(user_id, paap_action, severity_class):
         "proofs": []
     }
     
-    # Store the plan in the separate atonements collection
-    user = users_col.find_one({"user_id": user_id})
-    if not user:
+    # Create a unique plan ID (also confirms the user exists)
+    plan_number = await next_plan_number(user_id)
+    if plan_number is None:
         return None
-    
-    # Create a unique plan ID
-    existing_plans = list(atonements_col.find({"user_id": user_id}))
-    plan_id = f"{user_id}_{paap_action}_{len(existing_plans)}"
-    plan["plan_id"] = plan_id
+    plan["plan_id"] = f"{user_id}_{paap_action}_{plan_number}"
     
     # Store appeal in appeals collection
     appeal_record = {
@@ -82,16 +77,63 @@ def create_atonement_plan(user_id, paap_action, severity_class):
         "created_at": datetime.now(timezone.utc),
         "status": "pending"
     }
-    appeals_col.insert_one(appeal_record)
+    await async_appeals_col.insert_one(appeal_record)
     
     # Store atonement plan in atonements collection
-    atonements_col.insert_one(plan)
+    while True:
+        try:
+            await async_atonements_col.insert_one(plan)
+            break
+        except DuplicateKeyError:
+            # Only possible for numbers taken before the counter existed; move past them
+            plan.pop("_id", None)
+            plan["plan_id"] = f"{user_id}_{paap_action}_{await next_plan_number(user_id)}"
     
-    return serialize_mongodb_doc(plan)
+    await asyncio.gather(bump_user_stats(user_id, pending_atonements=1), bump_system_stats(total_atonements=1))
+    
+    # insert_one added the ObjectId; callers get a plain, JSON-ready document
+    plan.pop("_id", None)
+    return plan
+
+async def next_plan_number(user_id):
+    """
+    Reserve the user's next atonement plan number with an atomic counter on the user document.
+
+    New users start with the counter at 0. Users created before the counter existed
+    have it seeded once from their plan count, so new numbers continue the old
+    ``len(plans)`` sequence.
+
+    Args:
+        user_id (str): The user's ID
+
+    Returns:
+        int: The reserved number, or None if the user does not exist
+    """
+    while True:
+        user = await async_users_col.find_one_and_update(
+            {"user_id": user_id, "atonement_plan_count": {"$exists": True}},
+            {"$inc": {"atonement_plan_count": 1}},
+            projection={"_id": 0, "atonement_plan_count": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if user:
+            return user["atonement_plan_count"]
+        if not await user_exists(user_id):
+            return None
+        existing = await async_atonements_col.count_documents({"user_id": user_id})
+        # A concurrent seed may win; either way the counter exists on the next pass
+        await async_users_col.update_one(
+            {"user_id": user_id, "atonement_plan_count": {"$exists": False}},
+            {"$set": {"atonement_plan_count": existing}}
+        )
 
-def validate_atonement_proof(plan_id, atonement_type, amount, proof_text=None, tx_hash=None):
+async def validate_atonement_proof(plan_id, atonement_type, amount, proof_text=None, tx_hash=None):
     """
     Validate and record proof of atonement completion.
+
+    The proof and progress are applied in one find_one_and_update, and the plan is
+    completed by a conditional update, so concurrent proofs complete it (and
+    reward the user) exactly once.
     
     Args:
         plan_id (str): The atonement plan ID
@@ -103,18 +145,13 @@ def validate_atonement_proof(plan_id, atonement_type, amount, proof_text=None, t
     Returns:
         tuple: (success, message, updated_plan)
     """
-    # Find the plan in the atonements collection
-    plan = atonements_col.find_one({"plan_id": plan_id})
-    if not plan:
-        return False, "Atonement plan not found", None
-    
     # Validate atonement type
     if atonement_type not in ["Jap", "Tap", "Bhakti", "Daan"]:
-        return False, "Invalid atonement type", serialize_mongodb_doc(plan)
+        return False, "Invalid atonement type", None
     
     # For Daan, require transaction hash
     if atonement_type == "Daan" and not tx_hash:
-        return False, "Transaction hash required for Daan", serialize_mongodb_doc(plan)
+        return False, "Transaction hash required for Daan", None
     
     # Record the proof
     proof = {
@@ -130,51 +167,118 @@ def validate_atonement_proof(plan_id, atonement_type, amount, proof_text=None, t
     if tx_hash:
         proof["tx_hash"] = tx_hash
     
-    # Update the atonement plan in the atonements collection
-    atonements_col.update_one(
+    # Record the proof and read back the updated plan in one round trip
+    plan = await async_atonements_col.find_one_and_update(
         {"plan_id": plan_id},
         {
             "$push": {"proofs": proof},
             "$inc": {f"progress.{atonement_type}": amount}
-        }
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
-    
-    # Get the updated plan
-    plan = atonements_col.find_one({"plan_id": plan_id})
+    if not plan:
+        return False, "Atonement plan not found", None
     
     # Check if atonement is complete
-    is_complete = True
-    for atype, required in plan["requirements"].items():
-        if plan["progress"][atype] < required:
-            is_complete = False
-            break
+    is_complete = all(plan["progress"].get(atype, 0) >= required for atype, required in plan["requirements"].items())
     
-    if is_complete:
-        # Use the dedicated completion function to handle all updates
-        mark_atonement_completed(plan["user_id"], plan_id)
+    if is_complete and plan.get("status") != "completed":
+        # Only the submission whose conditional update wins applies the rewards;
+        # a concurrent submission that lost has completed the plan all the same
+        completed_at = await mark_atonement_completed(plan["user_id"], plan_id)
+        plan["status"] = "completed"
+        if completed_at:
+            plan["completed_at"] = completed_at
     
-    return True, "Atonement progress updated", serialize_mongodb_doc(plan)
+    return True, "Atonement progress updated", plan
 
-def get_user_atonement_plans(user_id, status=None):
+def encode_plan_cursor(plan):
     """
-    Get all atonement plans for a user, optionally filtered by status.
-    
+    Opaque keyset cursor pointing just past ``plan`` in (created_at, _id) order.
+
     Args:
-        user_id (str): The user's ID
-        status (str, optional): Filter by status ('pending', 'completed')
-        
+        plan (dict): A plan document including ``created_at`` and ``_id``
+
+    Returns:
+        str: URL-safe cursor string
+    """
+    created_at = plan["created_at"]
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    millis = (created_at - EPOCH) // timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(f"{millis}:{plan['_id']}".encode()).decode()
+
+def decode_plan_cursor(cursor):
+    """
+    Inverse of encode_plan_cursor.
+
     Returns:
-        list: List of atonement plans
+        tuple: (created_at, _id)
+
+    Raises:
+        ValueError: If the cursor is malformed
     """
-    # Query the atonements collection directly
+    try:
+        millis, object_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return EPOCH + timedelta(milliseconds=int(millis)), ObjectId(object_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _plans_query(user_id, status=None, after=None):
     query = {"user_id": user_id}
     if status:
         query["status"] = status
-    
-    plans = list(atonements_col.find(query))
-    return [serialize_mongodb_doc(plan) for plan in plans]
+    if after:
+        created_at, object_id = decode_plan_cursor(after)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "_id": {"$gt": object_id}}
+        ]
+    return query
+
+async def iter_atonement_plans(user_id, status=None, after=None, limit=None):
+    """
+    Iterate a user's plans oldest first straight from the cursor, without buffering.
+
+    Args:
+        user_id (str): The user's ID
+        status (str, optional): Filter by status ('pending', 'completed')
+        after (str, optional): Cursor from a previous page; only later plans are returned
+        limit (int, optional): Maximum number of plans
+
+    Yields:
+        dict: Plan documents including ``_id``
+    """
+    cursor = async_atonements_col.find(_plans_query(user_id, status, after)).sort(PLAN_ORDER)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for plan in cursor:
+        yield plan
 
-def mark_atonement_completed(user_id: str, atonement_plan_id: str):
+async def get_atonement_plan_page(user_id, status=None, after=None, limit=ATONEMENT_PAGE_SIZE):
+    """
+    Get one page of a user's plans, oldest first, using keyset pagination.
+
+    Args:
+        user_id (str): The user's ID
+        status (str, optional): Filter by status ('pending', 'completed')
+        after (str, optional): ``next_cursor`` of the previous page
+        limit (int, optional): Page size, capped at ATONEMENT_MAX_PAGE_SIZE
+
+    Returns:
+        tuple: (plans without ``_id``, next_cursor or None on the last page)
+    """
+    limit = max(1, min(limit, ATONEMENT_MAX_PAGE_SIZE))
+    # One extra plan tells us whether another page follows
+    plans = [plan async for plan in iter_atonement_plans(user_id, status, after, limit + 1)]
+    next_cursor = encode_plan_cursor(plans[limit - 1]) if len(plans) > limit else None
+    plans = plans[:limit]
+    for plan in plans:
+        del plan["_id"]
+    return plans, next_cursor
+
+async def mark_atonement_completed(user_id: str, atonement_plan_id: str):
     """
     Mark an atonement plan as completed and apply all rewards/updates.
     This function handles the complete completion flow including:
@@ -182,50 +286,44 @@ def mark_atonement_completed(user_id: str, atonement_plan_id: str):
     - Applying Q-learning rewards
     - Recalculating merit score and role
     - Recording the completion transaction
+
+    The status change is conditional on the plan not being completed yet, so
+    when several callers race only one of them applies the rewards.
+
+    Returns:
+        datetime: The completion time, or None if the plan was not found or
+        was already completed
     """
-    # Get the atonement plan
-    atonement = atonements_col.find_one({
-        'plan_id': atonement_plan_id,
-        'user_id': user_id
-    })
-    
+    completed_at = datetime.now(timezone.utc)
+    atonement = await async_atonements_col.find_one_and_update(
+        {'plan_id': atonement_plan_id, 'user_id': user_id, 'status': {'$ne': 'completed'}},
+        {'$set': {'status': 'completed', 'completed_at': completed_at}},
+        projection={'_id': 0, 'severity_class': 1, 'paap_class': 1}
+    )
     if not atonement:
-        return False
-    
-    # Get severity class (handle both field names)
-    severity_class = atonement.get('severity_class') or atonement.get('paap_class')
-    if not severity_class:
-        return False
-    
-    # Get user data
-    user = users_col.find_one({'user_id': user_id})
-    if not user:
-        return False
+        return None
     
-    # Apply Q-learning rewards for atonement completion
+    # Apply Q-learning rewards for atonement completion (handle both field names)
     severity_class = atonement.get('severity_class') or atonement.get('paap_class')
+    reward_recorded = False
     if severity_class:
         # This will add rewards to PaapTokens based on severity
-        reward_value, new_role = atonement_q_learning_step(user_id, severity_class)
+        reward_value, new_role = await atonement_q_learning_step(user_id, severity_class)
         
         # Record completion transaction for the reward
         if reward_value > 0:
-            transactions_col.insert_one({
+            await async_transactions_col.insert_one({
                 'user_id': user_id,
                 'type': 'atonement_completion_reward',
                 'token': f'PaapTokens.{severity_class}',
                 'amount': reward_value,
-                'timestamp': datetime.now(timezone.utc),
+                'timestamp': completed_at,
                 'plan_id': atonement_plan_id
             })
+            reward_recorded = True
     
-    # Mark atonement as completed
-    atonements_col.update_one(
-        {'plan_id': atonement_plan_id},
-        {'$set': {
-            'status': 'completed',
-            'completed_at': datetime.now(timezone.utc)
-        }}
-    )
+    await bump_user_stats(user_id, pending_atonements=-1, completed_atonements=1, total_actions=int(reward_recorded))
+    if reward_recorded:
+        await bump_system_stats(total_actions=1)
     
-    return True
\ No newline at end of file
+    return completed_at
@@ -0,0 +1,79 @@
+import numpy as np
+from config import MERIT_WEIGHTS, TOKEN_ATTRIBUTES
+from utils.thresholds import ROLE_INDEX, LOKA_INDEX
+
+PAAP_SEVERITIES = list(TOKEN_ATTRIBUTES["PaapTokens"].keys())
+
+# Columnar view of many users' balances; Paap columns are named paap_<severity>
+BALANCE_DTYPE = np.dtype(
+    [(token, "f8") for token in MERIT_WEIGHTS] +
+    [(f"paap_{severity}", "f8") for severity in PAAP_SEVERITIES]
+)
+
+SCORE_DTYPE = np.dtype([
+    ("merit", "f8"),
+    ("paap_score", "f8"),
+    ("net_karma", "f8"),
+    ("role", "U16"),
+    ("loka", "U16")
+])
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) else 0.0
+
+def users_to_balance_array(users):
+    """
+    Build a BALANCE_DTYPE structured array from user documents.
+
+    Args:
+        users (iterable): User documents with a ``balances`` field
+
+    Returns:
+        numpy.ndarray: One row per user, in input order
+    """
+    rows = []
+    for user in users:
+        balances = user.get("balances", {})
+        paap_tokens = balances.get("PaapTokens", {})
+        if not isinstance(paap_tokens, dict):
+            paap_tokens = {}
+        rows.append(
+            tuple(_number(balances.get(token, 0)) for token in MERIT_WEIGHTS) +
+            tuple(_number(paap_tokens.get(severity, 0)) for severity in PAAP_SEVERITIES)
+        )
+    return np.array(rows, dtype=BALANCE_DTYPE)
+
+def score_users(balances):
+    """
+    Score many users in one vectorized pass.
+
+    Equivalent, row for row, to compute_user_merit_score, get_total_paap_score,
+    calculate_net_karma, determine_role_from_merit and compute_loka_assignment.
+
+    Args:
+        balances (numpy.ndarray): Structured array with BALANCE_DTYPE
+
+    Returns:
+        numpy.ndarray: Structured array with SCORE_DTYPE, one row per input row
+    """
+    merit = np.zeros(len(balances))
+    for token, weight in MERIT_WEIGHTS.items():
+        merit += balances[token] * weight
+
+    paap_score = np.zeros(len(balances))
+    for severity in PAAP_SEVERITIES:
+        paap_score += balances[f"paap_{severity}"] * TOKEN_ATTRIBUTES["PaapTokens"][severity]["multiplier"]
+
+    net_karma = merit - paap_score
+
+    roles = ROLE_INDEX.classify_many(merit)
+    # Mrityuloka when the score falls between the configured ranges
+    lokas = LOKA_INDEX.classify_many(net_karma, default="Mrityuloka")
+
+    scores = np.empty(len(balances), dtype=SCORE_DTYPE)
+    scores["merit"] = merit
+    scores["paap_score"] = paap_score
+    scores["net_karma"] = net_karma
+    scores["role"] = roles
+    scores["loka"] = lokas
+    return scores
@@ -0,0 +1,118 @@
+import time
+from datetime import datetime
+import numpy as np
+from pymongo import UpdateOne
+from database import users_col, job_checkpoints_col
+from config import TOKEN_ATTRIBUTES, DECAY_SWEEP_BATCH_SIZE, DECAY_SWEEP_PAUSE_SECONDS
+from utils.tokens import now_utc
+
+CHECKPOINT_ID = "decay_sweeper"
+SWEEP_PROJECTION = {"_id": 0, "user_id": 1, "balances": 1, "token_meta": 1, "last_decay": 1}
+
+# Flat numeric tokens; PaapTokens is nested per severity and has no decay or expiry
+SWEPT_TOKENS = [token for token, attrs in TOKEN_ATTRIBUTES.items() if "daily_decay" in attrs]
+DECAY_RATES = np.array([TOKEN_ATTRIBUTES[token]["daily_decay"] for token in SWEPT_TOKENS])
+EXPIRY_DAYS = np.array([TOKEN_ATTRIBUTES[token].get("expiry_days") or np.inf for token in SWEPT_TOKENS])
+
+def _as_datetime(value, default):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+def decay_batch(users, now):
+    """
+    Apply decay and expiry to a batch of users in one vectorized pass.
+
+    Uses the same math as utils.tokens.compute_decay_and_expiry: balances decay by
+    ``(1 - daily_decay) ** days`` since last_decay and drop to zero once the token
+    is older than its expiry_days.
+
+    Args:
+        users (list): User documents projected with SWEEP_PROJECTION
+        now (datetime): Reference time for the sweep
+
+    Returns:
+        tuple: (new_balances, due) where new_balances is an (n_users, n_tokens) array
+               ordered like SWEPT_TOKENS and due marks users with time to decay
+    """
+    n = len(users)
+    balances = np.zeros((n, len(SWEPT_TOKENS)))
+    age_days = np.zeros((n, len(SWEPT_TOKENS)))
+    delta_days = np.zeros(n)
+
+    for i, user in enumerate(users):
+        delta_days[i] = (now - _as_datetime(user.get("last_decay"), now)).total_seconds() / 86400.0
+        user_balances = user.get("balances", {})
+        meta = user.get("token_meta", {})
+        for j, token in enumerate(SWEPT_TOKENS):
+            value = user_balances.get(token, 0)
+            balances[i, j] = value if isinstance(value, (int, float)) else 0
+            age_days[i, j] = (now - _as_datetime(meta.get(token, {}).get("created_at"), now)).days
+
+    due = delta_days > 0
+    decaying = (DECAY_RATES > 0) & (balances > 0)
+    factor = (1 - DECAY_RATES) ** np.maximum(delta_days, 0)[:, None]
+    new_balances = np.where(decaying, np.maximum(balances * factor, 0.0), balances)
+    new_balances[age_days >= EXPIRY_DAYS] = 0.0
+    return new_balances, due
+
+def build_decay_updates(users, now):
+    """Build one UpdateOne per user that is due, guarded on last_decay so users
+    touched by a request since they were read are left alone."""
+    new_balances, due = decay_batch(users, now)
+    ops = []
+    for i, user in enumerate(users):
+        if not due[i]:
+            continue
+        update = {f"balances.{token}": float(new_balances[i, j]) for j, token in enumerate(SWEPT_TOKENS)}
+        update.update({f"token_meta.{token}.last_update": now for token in TOKEN_ATTRIBUTES})
+        update["last_decay"] = now
+        ops.append(UpdateOne(
+            {"user_id": user["user_id"], "last_decay": user.get("last_decay")},
+            {"$set": update, "$inc": {"version": 1}}
+        ))
+    return ops
+
+def sweep_decay(batch_size=DECAY_SWEEP_BATCH_SIZE, pause_seconds=DECAY_SWEEP_PAUSE_SECONDS, resume=True):
+    """
+    Walk the users collection in user_id order and materialize decay and expiry.
+
+    Progress is checkpointed after every batch, so an interrupted sweep resumes
+    where it stopped; the checkpoint is cleared once the sweep completes.
+
+    Args:
+        batch_size (int): Users read and written per batch
+        pause_seconds (float): Sleep between batches to throttle load on the cluster
+        resume (bool): Continue from the last checkpoint instead of starting over
+
+    Returns:
+        int: Number of user documents updated
+    """
+    checkpoint = job_checkpoints_col.find_one({"_id": CHECKPOINT_ID}) if resume else None
+    last_user_id = checkpoint["last_user_id"] if checkpoint else None
+    updated = 0
+
+    while True:
+        query = {"user_id": {"$gt": last_user_id}} if last_user_id is not None else {}
+        users = list(users_col.find(query, SWEEP_PROJECTION).sort("user_id", 1).limit(batch_size))
+        if not users:
+            break
+
+        now = now_utc()
+        ops = build_decay_updates(users, now)
+        if ops:
+            updated += users_col.bulk_write(ops, ordered=False).modified_count
+
+        last_user_id = users[-1]["user_id"]
+        job_checkpoints_col.update_one(
+            {"_id": CHECKPOINT_ID},
+            {"$set": {"last_user_id": last_user_id, "updated_at": now}},
+            upsert=True
+        )
+        if pause_seconds:
+            time.sleep(pause_seconds)
+
+    job_checkpoints_col.delete_one({"_id": CHECKPOINT_ID})
+    return updated
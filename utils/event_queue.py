@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from database import async_karma_events_col
+from config import EVENT_QUEUE_LEASE_SECONDS, EVENT_QUEUE_POLL_INTERVAL, EVENT_QUEUE_MAX_ATTEMPTS, EVENT_QUEUE_RETRY_BACKOFF_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Lease value for events that are queued and immediately claimable
+AVAILABLE = datetime(1970, 1, 1)
+
+# Set whenever this process enqueues an event, so idle workers wake without waiting to poll.
+# Created by the workers in their running loop: before Python 3.10 an Event binds to the
+# loop current at creation, so one made at import would fail in the server's loop
+_enqueued = None
+_enqueued_loop = None
+
+def _enqueued_event():
+    global _enqueued, _enqueued_loop
+    loop = asyncio.get_running_loop()
+    if _enqueued_loop is not loop:
+        _enqueued, _enqueued_loop = asyncio.Event(), loop
+    return _enqueued
+
+def notify_enqueued():
+    """Wake this process's idle workers after an event was enqueued."""
+    if _enqueued is not None:
+        _enqueued.set()
+
+async def claim_event(worker_id, lease_seconds=EVENT_QUEUE_LEASE_SECONDS):
+    """
+    Atomically claim the oldest queued event whose lease is free or expired.
+
+    Queued events are ``pending`` with a ``lease_expires_at``. Events being
+    processed synchronously are leased to their request, so they are only
+    claimed once that lease expires. A worker that dies mid-event loses its
+    lease after ``lease_seconds`` and the event is claimed again, so processing
+    is at-least-once.
+
+    Args:
+        worker_id (str): Identifies the claiming worker
+        lease_seconds (float, optional): How long the claim is held
+
+    Returns:
+        dict: The claimed event document, or None if the queue is empty
+    """
+    now = datetime.utcnow()
+    return await async_karma_events_col.find_one_and_update(
+        {"status": "pending", "lease_expires_at": {"$lte": now}},
+        {
+            "$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds), "claimed_by": worker_id},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("lease_expires_at", 1), ("created_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def complete_event(event, worker_id):
+    """
+    Record the outcome of a claimed event and release its lease.
+
+    Returns:
+        bool: False if the lease had already passed to another worker
+    """
+    result = await async_karma_events_col.update_one(
+        {"event_id": event["event_id"], "claimed_by": worker_id},
+        {
+            "$set": {
+                "status": event["status"],
+                "response_data": event.get("response_data"),
+                "error_message": event.get("error_message"),
+                "updated_at": datetime.utcnow()
+            },
+            "$unset": {"lease_expires_at": ""}
+        }
+    )
+    return result.modified_count == 1
+
+async def release_event(event, worker_id, backoff_seconds=EVENT_QUEUE_RETRY_BACKOFF_SECONDS):
+    """
+    Return a claimed event to the queue after a transient failure.
+
+    The event stays pending and becomes claimable again after an exponential
+    backoff of ``backoff_seconds * 2 ** (attempts - 1)``.
+
+    Returns:
+        bool: False if the lease had already passed to another worker
+    """
+    now = datetime.utcnow()
+    delay = backoff_seconds * 2 ** (event["attempts"] - 1)
+    result = await async_karma_events_col.update_one(
+        {"event_id": event["event_id"], "claimed_by": worker_id},
+        {
+            "$set": {
+                "lease_expires_at": now + timedelta(seconds=delay),
+                "error_message": event.get("error_message"),
+                "updated_at": now
+            },
+            "$unset": {"claimed_by": ""}
+        }
+    )
+    return result.modified_count == 1
+
+async def run_event_worker(process, worker_id, poll_interval=EVENT_QUEUE_POLL_INTERVAL):
+    """
+    Background task that claims queued events and processes them one at a time.
+
+    Args:
+        process (callable): Coroutine function taking the claimed event document
+            and returning it with ``status``, ``response_data`` and ``error_message`` set,
+            and ``retryable`` true if it failed in a way worth retrying
+        worker_id (str): Identifies this worker in lease claims
+        poll_interval (float, optional): Seconds to wait when the queue is empty
+    """
+    enqueued = _enqueued_event()
+    while True:
+        try:
+            event = await claim_event(worker_id)
+        except Exception:
+            logger.exception("Error claiming queued event")
+            event = None
+
+        if event is None:
+            enqueued.clear()
+            try:
+                await asyncio.wait_for(enqueued.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            if event["attempts"] > EVENT_QUEUE_MAX_ATTEMPTS:
+                event.update(status="failed", error_message=f"Gave up after {EVENT_QUEUE_MAX_ATTEMPTS} attempts")
+            else:
+                event = await process(event)
+            if event.get("retryable") and event["attempts"] < EVENT_QUEUE_MAX_ATTEMPTS:
+                if not await release_event(event, worker_id):
+                    logger.warning("Lease on event %s expired before it was released", event["event_id"])
+            elif not await complete_event(event, worker_id):
+                logger.warning("Lease on event %s expired before it completed", event["event_id"])
+        except Exception:
+            # Leave the lease to expire so the event is retried
+            logger.exception("Error processing queued event %s", event["event_id"])
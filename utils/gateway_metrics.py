@@ -0,0 +1,63 @@
+import asyncio
+from contextlib import asynccontextmanager
+from config import LOOP_LAG_SAMPLE_INTERVAL
+
+class GatewayMetrics:
+    """
+    Load on the event gateway: handlers in flight and how late the event loop runs.
+
+    Handlers are coroutines, so saturation shows up as event-loop lag (time a
+    ready task waits for the loop) rather than as a queue for threads. Only
+    touched from the event loop, so no locking is needed.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.loop_lag_ms = 0.0
+        self.max_loop_lag_ms = 0.0
+
+    @asynccontextmanager
+    async def track(self):
+        """Count a handler call as in flight while the block runs."""
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    async def run_lag_monitor(self, interval=LOOP_LAG_SAMPLE_INTERVAL):
+        """Background task that measures how much later than asked a sleep of ``interval`` wakes up."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag_ms = 1000 * max(0.0, loop.time() - started - interval)
+            self.loop_lag_ms = lag_ms
+            self.max_loop_lag_ms = max(self.max_loop_lag_ms, lag_ms)
+
+    def snapshot(self):
+        """
+        Current gateway load.
+
+        Returns:
+            dict: Handlers in flight (now and peak), completed and failed handler
+            calls, and the latest and maximum event-loop lag in milliseconds
+        """
+        return {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "loop_lag_ms": self.loop_lag_ms,
+            "max_loop_lag_ms": self.max_loop_lag_ms
+        }
+
+gateway_metrics = GatewayMetrics()
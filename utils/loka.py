@@ -1,5 +1,7 @@
-from config import LOKA_THRESHOLDS
+from datetime import datetime, timezone
+from config import LOKA_THRESHOLDS, MERIT_WEIGHTS, TOKEN_ATTRIBUTES
 from utils.merit import compute_user_merit_score
+from utils.thresholds import LOKA_INDEX
 
 def calculate_net_karma(user):
     """
@@ -15,13 +17,10 @@ def calculate_net_karma(user):
     punya_score = 0
     if "balances" in user:
         balances = user["balances"]
-        # Sum up positive tokens with their weights
-        if "DharmaPoints" in balances:
-            punya_score += balances["DharmaPoints"] * 1.0
-        if "SevaPoints" in balances:
-            punya_score += balances["SevaPoints"] * 1.2
-        if "PunyaTokens" in balances:
-            punya_score += balances["PunyaTokens"] * 3.0
+        # Sum up positive tokens with their merit weights
+        for token, weight in MERIT_WEIGHTS.items():
+            if token in balances:
+                punya_score += balances[token] * weight
     
     # Calculate negative karma (Paap)
     paap_score = 0
@@ -29,13 +28,10 @@ def calculate_net_karma(user):
         paap_tokens = user["balances"]["PaapTokens"]
         # Ensure PaapTokens is a dictionary with severity categories
         if isinstance(paap_tokens, dict):
-            # Sum up negative tokens with their weights
-            if "minor" in paap_tokens:
-                paap_score += paap_tokens["minor"] * 1.0
-            if "medium" in paap_tokens:
-                paap_score += paap_tokens["medium"] * 2.5
-            if "maha" in paap_tokens:
-                paap_score += paap_tokens["maha"] * 5.0
+            # Sum up negative tokens with their severity multipliers
+            for severity, attrs in TOKEN_ATTRIBUTES["PaapTokens"].items():
+                if severity in paap_tokens:
+                    paap_score += paap_tokens[severity] * attrs["multiplier"]
         else:
             # If PaapTokens is not a dict, treat it as 0
             paap_score = 0
@@ -56,16 +52,12 @@ def compute_loka_assignment(user):
     net_karma = calculate_net_karma(user)
     
     # Determine loka based on thresholds
-    assigned_loka = "Mrityuloka"  # Default loka (middle realm)
-    description = "The mortal realm, where souls continue their journey."
+    assigned_loka = LOKA_INDEX.classify(net_karma)
+    if assigned_loka is None:
+        # Default loka (middle realm) for scores between the configured ranges
+        return "Mrityuloka", "The mortal realm, where souls continue their journey."
     
-    for loka, threshold in LOKA_THRESHOLDS.items():
-        if net_karma >= threshold["min_karma"] and net_karma <= threshold["max_karma"]:
-            assigned_loka = loka
-            description = threshold["description"]
-            break
-    
-    return assigned_loka, description
+    return assigned_loka, LOKA_THRESHOLDS[assigned_loka]["description"]
 
 def create_rebirth_carryover(user):
     """
@@ -105,7 +97,7 @@ def create_rebirth_carryover(user):
     
     return carryover
 
-def apply_rebirth(user_id, carryover):
+async def apply_rebirth(user_id, carryover):
     """
     Apply rebirth effects to a user, resetting their state but applying carryover.
     
@@ -116,10 +108,13 @@ def apply_rebirth(user_id, carryover):
     Returns:
         dict: Updated user document
     """
-    from database import users_col
+    from database import async_users_col
+    from utils.user_repository import get_user, PROFILE
+    from utils.user_locks import user_locks
+    from utils.tokens import now_utc
     
     # Get the user
-    user = users_col.find_one({"user_id": user_id})
+    user = await get_user(user_id, PROFILE)
     if not user:
         return None
     
@@ -147,19 +142,22 @@ def apply_rebirth(user_id, carryover):
         new_balances["PaapTokens"]["medium"] = paap_per_category
         new_balances["PaapTokens"]["maha"] = paap_per_category
     
-    # Update user with new state
-    users_col.update_one(
-        {"user_id": user_id},
-        {
-            "$set": {
-                "balances": new_balances,
-                "role": carryover["starting_level"],
-                "rebirth_count": user.get("rebirth_count", 0) + 1,
-                "last_rebirth": {"timestamp": datetime.now(timezone.utc), "carryover": carryover}
-            },
-            "$unset": {"atonement_plans": ""}  # Clear atonement plans
-        }
-    )
+    # Update user with new state, serialized with the other writers of this user's balances
+    async with user_locks.hold(user_id):
+        await async_users_col.update_one(
+            {"user_id": user_id},
+            {
+                "$set": {
+                    "balances": new_balances,
+                    "role": carryover["starting_level"],
+                    "last_rebirth": {"timestamp": datetime.now(timezone.utc), "carryover": carryover},
+                    # The reset balances start undecayed; this also fails any in-flight action's decay guard
+                    "last_decay": now_utc()
+                },
+                "$unset": {"atonement_plans": ""},  # Clear atonement plans
+                "$inc": {"rebirth_count": 1, "version": 1}
+            }
+        )
     
     # Return updated user
-    return users_col.find_one({"user_id": user_id})
\ No newline at end of file
+    return await get_user(user_id, PROFILE)
\ No newline at end of file
@@ -1,12 +1,8 @@
-from config import LEVEL_THRESHOLDS
+from config import MERIT_WEIGHTS
+from utils.thresholds import ROLE_INDEX
 def compute_user_merit_score(user_doc):
     b = user_doc["balances"]
-    return b.get("DharmaPoints", 0) * 1.0 + b.get("SevaPoints", 0) * 1.2 + b.get("PunyaTokens", 0) * 3.0
+    return sum(b.get(token, 0) * weight for token, weight in MERIT_WEIGHTS.items())
 
 def determine_role_from_merit(score):
-    roles_sorted = sorted(LEVEL_THRESHOLDS.items(), key=lambda x: x[1])
-    current = "learner"
-    for role, thr in roles_sorted:
-        if score >= thr:
-            current = role
-    return current
+    return ROLE_INDEX.classify(score)
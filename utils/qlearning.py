@@ -1,62 +1,61 @@
-import datetime
-import numpy as np
-from database import qtable_col, users_col
-from config import ACTIONS, ROLE_SEQUENCE, ALPHA, GAMMA, REWARD_MAP, CHEAT_PUNISHMENT_LEVELS, ATONEMENT_REWARDS
-from utils.merit import determine_role_from_merit
+import logging
+from database import async_users_col
+from config import ACTIONS, ROLE_SEQUENCE, REWARD_MAP, CHEAT_PUNISHMENT_LEVELS, ATONEMENT_REWARDS, QTABLE_SYNC_MODE, QLEARNING_BATCH_MODE, QLEARNING_BUFFER_SIZE
+from utils.merit import compute_user_merit_score, determine_role_from_merit
+from utils.qtable import QTable
+from utils.user_repository import get_user, ROLE_BALANCES
+from utils.user_locks import user_locks
+
+logger = logging.getLogger(__name__)
 
 states = ROLE_SEQUENCE[:]
 n_states = len(states)
 n_actions = len(ACTIONS)
-Q = np.zeros((n_states, n_actions))
+q_table = QTable(
+    n_states, n_actions,
+    sync_mode=QTABLE_SYNC_MODE,
+    buffer_size=QLEARNING_BUFFER_SIZE if QLEARNING_BATCH_MODE else None
+)
 
-# restore Q-table from DB
-q_doc = qtable_col.find_one({})
-if q_doc and "q" in q_doc:
-    try:
-        Q = np.array(q_doc["q"])
-        # Ensure Q-table has the correct shape
-        if Q.shape != (n_states, n_actions):
-            print(f"DEBUG: Q-table shape mismatch. Expected {(n_states, n_actions)}, got {Q.shape}. Resetting.")
-            Q = np.zeros((n_states, n_actions))
-    except Exception as e:
-        print(f"DEBUG: Error restoring Q-table: {e}. Resetting.")
-        Q = np.zeros((n_states, n_actions))
-else:
-    print(f"DEBUG: No Q-table found in DB. Creating new one with shape {(n_states, n_actions)}")
-    Q = np.zeros((n_states, n_actions))
+def get_q_table():
+    return q_table
 
-def save_q_table():
-    # Use timezone-aware datetime (fix for Python 3.12+)
-    qtable_col.replace_one({}, {"q": Q.tolist(), "updated_at": datetime.datetime.now(datetime.timezone.utc)}, upsert=True)
+async def load_q_table():
+    """Restore the Q-table from MongoDB; called from the app's startup hook."""
+    return await q_table.load_from_db()
 
-def q_learning_step(user_id: str, state: str, action: str, reward: float):
-    print(f"DEBUG q_learning_step: user_id={user_id}, state={state}, action={action}, reward={reward}")
-    
-    # Ensure state is valid
+async def flush_q_table():
+    """Persist Q updates made since the last flush."""
+    await q_table.flush()
+
+async def run_q_table_flusher():
+    await q_table.run_flusher()
+
+async def run_q_batch_learner():
+    await q_table.run_batch_learner()
+
+def plan_q_transition(state: str, action: str, reward: float, balances: dict):
+    """
+    Work out the Q-learning transition for an action without applying it, so
+    callers can learn only once their write has committed.
+
+    Args:
+        state (str): The user's current role
+        action (str): The action taken
+        reward (float): The reward (or penalty) for the action
+        balances (dict): The user's balances before the reward is applied
+
+    Returns:
+        tuple: ((s, a, reward, next_state) or None for an unknown action, next_role)
+    """
     if state not in states:
-        state = states[0]  # Default to first state if invalid
+        state = states[0]
     s = states.index(state)
-    print(f"DEBUG: state={state}, s={s}")
-    
-    # Ensure action is valid
     if action not in ACTIONS:
-        # Handle unknown action gracefully
-        print(f"DEBUG: action {action} not in ACTIONS")
-        return reward, state
+        return None, state
     a = ACTIONS.index(action)
-    print(f"DEBUG: action={action}, a={a}")
-
-    user_doc = users_col.find_one({"user_id": user_id})
-    if not user_doc:
-        print(f"DEBUG: user {user_id} not found")
-        return reward, state
 
-    print(f"DEBUG: user_doc={user_doc}")
-    print(f"DEBUG: user_doc.balances type={type(user_doc.get('balances'))}")
-    print(f"DEBUG: user_doc.balances={user_doc.get('balances')}")
-    
-    temp_balances = user_doc["balances"].copy()
-    print(f"DEBUG: temp_balances={temp_balances}")
+    temp_balances = balances.copy()
     
     # Get the appropriate token for the action
     if action == "cheat":
@@ -70,37 +69,27 @@ def q_learning_step(user_id: str, state: str, action: str, reward: float):
             # Default token if action not found
             token = "DharmaPoints"
     
-    print(f"DEBUG: token={token}")
-    
     # Update the correct token balance
     current_balance = temp_balances.get(token, 0)
     # Ensure the current balance is a number, not a dict
     if isinstance(current_balance, dict):
         current_balance = 0
     temp_balances[token] = current_balance + reward
-    print(f"DEBUG: current_balance={current_balance}, new balance={temp_balances[token]}")
 
-    estimated_merit = temp_balances.get("DharmaPoints", 0) * 1.0 + temp_balances.get("SevaPoints", 0) * 1.2 + temp_balances.get("PunyaTokens", 0) * 3.0
-    print(f"DEBUG: estimated_merit={estimated_merit}")
+    estimated_merit = compute_user_merit_score({"balances": temp_balances})
     next_role = determine_role_from_merit(estimated_merit)
-    print(f"DEBUG: next_role={next_role}")
     
     # Check if next_role is in states before calling index
     if next_role not in states:
-        print(f"DEBUG: next_role {next_role} not in states {states}")
+        logger.debug("Next role %s not in states %s", next_role, states)
         next_state = 0  # Default to first state
     else:
         next_state = states.index(next_role)
-    print(f"DEBUG: next_state={next_state}")
 
-    print(f"DEBUG: Q.shape={Q.shape}, s={s}, a={a}, next_state={next_state}")
-    Q[s, a] = Q[s, a] + ALPHA * (reward + GAMMA * float(np.max(Q[next_state])) - Q[s, a])
-    save_q_table()
-    
-    # Return the reward and the next role as expected
-    return reward, next_role
+    logger.debug("Q update s=%s a=%s next_state=%s reward=%s estimated_merit=%s", s, a, next_state, reward, estimated_merit)
+    return (s, a, reward, next_state), next_role
 
-def atonement_q_learning_step(user_id: str, severity_class: str):
+async def atonement_q_learning_step(user_id: str, severity_class: str):
     """
     Apply Q-learning update for atonement completion.
     
@@ -112,7 +101,7 @@ def atonement_q_learning_step(user_id: str, severity_class: str):
         tuple: (reward_value, next_role)
     """
     # Get user and current state
-    user_doc = users_col.find_one({"user_id": user_id})
+    user_doc = await get_user(user_id, ROLE_BALANCES)
     if not user_doc:
         return 0, None
     
@@ -147,7 +136,7 @@ def atonement_q_learning_step(user_id: str, severity_class: str):
         temp_balances[token] = temp_balances.get(token, 0) + reward_value
     
     # Calculate next state based on updated balances
-    estimated_merit = temp_balances.get("DharmaPoints", 0) * 1.0 + temp_balances.get("SevaPoints", 0) * 1.2 + temp_balances.get("PunyaTokens", 0) * 3.0
+    estimated_merit = compute_user_merit_score({"balances": temp_balances})
     next_role = determine_role_from_merit(estimated_merit)
     next_state = states.index(next_role)
     
@@ -157,22 +146,18 @@ def atonement_q_learning_step(user_id: str, severity_class: str):
         a = ACTIONS.index(atonement_action)
         
         # Update Q-table with positive reinforcement for atonement
-        Q[s, a] = Q[s, a] + ALPHA * (reward_value + GAMMA * float(np.max(Q[next_state])) - Q[s, a])
-        save_q_table()
+        q_table.learn(s, a, reward_value, next_state)
     
     # Update user's balance with the reward
     if token.startswith("PaapTokens."):
         # Handle nested PaapTokens structure
         paap_severity = token.split(".")[1]
-        users_col.update_one(
-            {"user_id": user_id},
-            {"$inc": {f"balances.PaapTokens.{paap_severity}": reward_value}}
-        )
+        inc = {f"balances.PaapTokens.{paap_severity}": reward_value, "version": 1}
     else:
         # Handle regular tokens
-        users_col.update_one(
-            {"user_id": user_id},
-            {"$inc": {f"balances.{token}": reward_value}}
-        )
+        inc = {f"balances.{token}": reward_value, "version": 1}
+    # Serialized with the other writers of this user's balances
+    async with user_locks.hold(user_id):
+        await async_users_col.update_one({"user_id": user_id}, {"$inc": inc})
     
     return reward_value, next_role
\ No newline at end of file
@@ -0,0 +1,308 @@
+import asyncio
+import datetime
+import logging
+import threading
+from contextlib import ExitStack
+import numpy as np
+from pymongo import ReturnDocument
+from database import async_qtable_col
+from config import ALPHA, GAMMA, QTABLE_FLUSH_INTERVAL, QTABLE_FLUSH_EVERY, QLEARNING_BATCH_INTERVAL, QTABLE_LOAD_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class TransitionBuffer:
+    """
+    Fixed-size ring buffer of (state, action, reward, next_state) transitions.
+
+    When full, the oldest transitions are overwritten and counted in ``dropped``.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.intp)
+        self.actions = np.zeros(capacity, dtype=np.intp)
+        self.rewards = np.zeros(capacity)
+        self.next_states = np.zeros(capacity, dtype=np.intp)
+        self.dropped = 0
+        self._head = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, s, a, reward, next_state):
+        with self._lock:
+            i = self._head
+            self.states[i], self.actions[i], self.rewards[i], self.next_states[i] = s, a, reward, next_state
+            self._head = (i + 1) % self.capacity
+            if self._count == self.capacity:
+                self.dropped += 1
+            else:
+                self._count += 1
+
+    def drain(self):
+        """Remove and return all buffered transitions, oldest first, as four arrays."""
+        with self._lock:
+            order = (np.arange(self._count) + self._head - self._count) % self.capacity
+            batch = (self.states[order], self.actions[order], self.rewards[order], self.next_states[order])
+            self._count = 0
+            return batch
+
+class QTable:
+    """
+    Process-wide Q-table with atomic TD updates and batched persistence.
+
+    Every state row has its own lock, so updates to different states proceed in
+    parallel while updates to the same row are serialized. ``generation`` counts
+    updates; ``persisted_generation`` is the generation last written to MongoDB.
+
+    The table starts as zeros and is filled from MongoDB by ``load_from_db``.
+    Until that succeeds (``loaded``) nothing is persisted, so a slow or failed
+    startup load can never overwrite the stored table with zeros.
+
+    Persistence follows ``sync_mode``:
+
+    - ``"replace"``: the flusher writes the whole table, so with several worker
+      processes the last writer wins.
+    - ``"delta"``: the flusher ``$inc``s the TD deltas accumulated since its last
+      push into the individual cells of the shared document and pulls the merged
+      table back, so every worker's learning is combined.
+    """
+
+    def __init__(self, n_states, n_actions, sync_mode="replace", buffer_size=None):
+        self.shape = (n_states, n_actions)
+        self.sync_mode = sync_mode
+        # With a buffer, learn() only enqueues and run_batch_learner() applies updates
+        self.buffer = TransitionBuffer(buffer_size) if buffer_size else None
+        self.values = np.zeros(self.shape)
+        # Updates applied to each cell by this process since startup
+        self.visits = np.zeros(self.shape, dtype=np.int64)
+        self.generation = 0
+        self.persisted_generation = 0
+        self.loaded = False
+        self._deltas = np.zeros(self.shape)
+        self._row_locks = [threading.Lock() for _ in range(n_states)]
+        self._counter_lock = threading.Lock()
+        # Created by run_flusher: before Python 3.10 an Event binds to the loop current at creation
+        self._flush_requested = None
+
+    def _lock_all_rows(self):
+        stack = ExitStack()
+        for lock in self._row_locks:
+            stack.enter_context(lock)
+        return stack
+
+    def _replace_values(self, values):
+        # Keep updates made since the values were read (e.g. during a pull)
+        with self._lock_all_rows():
+            self.values = values + self._deltas
+
+    def load(self, doc):
+        """
+        Restore from a stored q_table document, keeping zeros if it is missing or malformed.
+
+        Updates learned before the load (starting from zeros) are kept on top of
+        the stored values.
+        """
+        self.loaded = True
+        if not doc or "q" not in doc:
+            logger.info("No Q-table found in DB; starting with zeros of shape %s", self.shape)
+            return
+        try:
+            values = np.array(doc["q"], dtype=float)
+        except Exception as e:
+            logger.warning("Error restoring Q-table: %s; resetting", e)
+            return
+        if values.shape != self.shape:
+            logger.warning("Q-table shape mismatch: expected %s, got %s; resetting", self.shape, values.shape)
+            return
+        with self._lock_all_rows():
+            self.values = values + self.values
+        with self._counter_lock:
+            local_updates = self.generation - self.persisted_generation
+            self.persisted_generation = doc.get("generation", 0)
+            self.generation = self.persisted_generation + local_updates
+
+    async def load_from_db(self, timeout=QTABLE_LOAD_TIMEOUT):
+        """
+        Read the stored table, giving up after ``timeout`` seconds.
+
+        Returns:
+            bool: True if the table was loaded (or none is stored yet)
+        """
+        try:
+            doc = await asyncio.wait_for(async_qtable_col.find_one({}), timeout=timeout)
+        except Exception as e:
+            logger.warning("Could not load Q-table (%s); serving with zeros until it loads", e)
+            return False
+        self.load(doc)
+        return True
+
+    def _count_updates(self, n):
+        with self._counter_lock:
+            self.generation += n
+            pending = self.generation - self.persisted_generation
+        if pending >= QTABLE_FLUSH_EVERY and self._flush_requested is not None:
+            self._flush_requested.set()
+
+    def learn(self, s, a, reward, next_state):
+        """Record a transition: enqueue it in batch mode, otherwise apply it immediately."""
+        if self.buffer is not None:
+            self.buffer.append(s, a, reward, next_state)
+        else:
+            self.update(s, a, reward, next_state)
+
+    def update(self, s, a, reward, next_state):
+        """
+        Apply one TD update to Q[s, a] atomically.
+
+        Returns:
+            float: The updated Q[s, a]
+        """
+        target = reward + GAMMA * float(np.max(self.values[next_state]))
+        with self._row_locks[s]:
+            delta = ALPHA * (target - self.values[s, a])
+            self.values[s, a] += delta
+            self.visits[s, a] += 1
+            if self.sync_mode == "delta":
+                self._deltas[s, a] += delta
+            value = self.values[s, a]
+        self._count_updates(1)
+        return value
+
+    def apply_batch(self, s, a, rewards, next_states):
+        """
+        Apply a batch of TD updates in one vectorized step.
+
+        All targets are computed from the table as it was before the batch. A
+        cell that appears several times gets one step of ALPHA times its mean
+        TD error, so repeats cannot push it past its targets the way summing
+        their deltas would.
+
+        Returns:
+            int: Number of transitions applied
+        """
+        if len(s) == 0:
+            return 0
+        cells = np.ravel_multi_index((s, a), self.shape)
+        unique_cells, inverse, counts = np.unique(cells, return_inverse=True, return_counts=True)
+        rows, cols = np.unravel_index(unique_cells, self.shape)
+        with self._lock_all_rows():
+            targets = rewards + GAMMA * self.values[next_states].max(axis=1)
+            td_sums = np.bincount(inverse, weights=targets - self.values[s, a], minlength=len(unique_cells))
+            deltas = ALPHA * td_sums / counts
+            self.values[rows, cols] += deltas
+            self.visits[rows, cols] += counts
+            if self.sync_mode == "delta":
+                self._deltas[rows, cols] += deltas
+        self._count_updates(len(s))
+        return len(s)
+
+    def apply_pending(self):
+        """Apply everything waiting in the transition buffer."""
+        if self.buffer is None:
+            return 0
+        return self.apply_batch(*self.buffer.drain())
+
+    async def run_batch_learner(self, interval=QLEARNING_BATCH_INTERVAL):
+        """Background task that applies buffered transitions every ``interval`` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.apply_pending()
+            except Exception:
+                logger.exception("Error applying buffered Q updates")
+
+    def snapshot(self):
+        """Return a consistent copy of the table."""
+        with self._lock_all_rows():
+            return self.values.copy()
+
+    def visit_counts(self):
+        """Return a copy of the per-cell update counts."""
+        with self._lock_all_rows():
+            return self.visits.copy()
+
+    async def save(self):
+        """Write the whole table, replacing the stored document."""
+        with self._counter_lock:
+            generation = self.generation
+        values = self.snapshot()
+        # Use timezone-aware datetime (fix for Python 3.12+)
+        await async_qtable_col.replace_one({}, {
+            "q": values.tolist(),
+            "generation": generation,
+            "updated_at": datetime.datetime.now(datetime.timezone.utc)
+        }, upsert=True)
+        with self._counter_lock:
+            self.persisted_generation = max(self.persisted_generation, generation)
+
+    async def push_and_pull(self):
+        """Push local TD deltas as per-cell $inc operations and merge in other workers' updates."""
+        with self._lock_all_rows():
+            deltas, self._deltas = self._deltas, np.zeros(self.shape)
+            with self._counter_lock:
+                pushed_generation = self.generation
+                pushed = pushed_generation - self.persisted_generation
+
+        try:
+            increments = {f"q.{i}.{j}": float(deltas[i, j]) for i, j in zip(*np.nonzero(deltas))}
+            if increments:
+                increments["generation"] = pushed
+                update = {"$inc": increments, "$set": {"updated_at": datetime.datetime.now(datetime.timezone.utc)}}
+                doc = await async_qtable_col.find_one_and_update({}, update, return_document=ReturnDocument.AFTER)
+                if doc is None:
+                    # First push against an empty collection: create the shared zero table, then apply
+                    await async_qtable_col.update_one(
+                        {}, {"$setOnInsert": {"q": np.zeros(self.shape).tolist(), "generation": 0}}, upsert=True
+                    )
+                    doc = await async_qtable_col.find_one_and_update({}, update, return_document=ReturnDocument.AFTER)
+            else:
+                doc = await async_qtable_col.find_one({})
+        except Exception:
+            # Nothing was confirmed as applied, so keep the deltas for the next push
+            with self._lock_all_rows():
+                self._deltas += deltas
+            raise
+        if not doc or "q" not in doc:
+            return
+
+        merged = np.array(doc["q"], dtype=float)
+        if merged.shape != self.shape:
+            logger.warning("Shared Q-table has shape %s, expected %s; overwriting it", merged.shape, self.shape)
+            await self.save()
+            return
+
+        self._replace_values(merged)
+        with self._counter_lock:
+            local_since_push = self.generation - pushed_generation
+            self.persisted_generation = doc.get("generation", 0)
+            self.generation = self.persisted_generation + local_since_push
+
+    async def flush(self):
+        """Persist pending updates according to ``sync_mode``."""
+        self.apply_pending()
+        if not self.loaded and not await self.load_from_db():
+            return
+        if self.sync_mode == "delta":
+            await self.push_and_pull()
+        elif self.generation != self.persisted_generation:
+            await self.save()
+
+    async def run_flusher(self, interval=QTABLE_FLUSH_INTERVAL):
+        """
+        Background task that flushes every ``interval`` seconds, or as soon as
+        QTABLE_FLUSH_EVERY updates are pending.
+        """
+        self._flush_requested = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Error flushing Q-table; will retry")
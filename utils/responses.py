@@ -0,0 +1,33 @@
+from decimal import Decimal
+import orjson
+from bson import ObjectId, Decimal128
+from fastapi.responses import JSONResponse
+
+def bson_default(obj):
+    """orjson hook for the BSON types MongoDB documents can carry."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+class MongoJSONResponse(JSONResponse):
+    """
+    JSON response encoded by orjson, with ObjectId and Decimal128 handled by a type hook.
+
+    Returning an instance directly from a route skips FastAPI's jsonable_encoder,
+    so documents read from MongoDB are encoded in one pass without an intermediate copy.
+    """
+
+    def render(self, content):
+        return orjson.dumps(content, default=bson_default, option=JSON_OPTIONS)
+
+async def ndjson_lines(docs):
+    """Encode documents from an async iterator as NDJSON lines, without their ``_id``."""
+    async for doc in docs:
+        doc.pop("_id", None)
+        yield orjson.dumps(doc, default=bson_default, option=JSON_OPTIONS) + b"\n"
@@ -0,0 +1,113 @@
+import asyncio
+from pymongo import UpdateOne
+from database import (
+    async_users_col, async_transactions_col, async_atonements_col, async_counters_col,
+    users_col, transactions_col, atonements_col, counters_col
+)
+
+SYSTEM_COUNTERS_ID = "system"
+USER_STAT_FIELDS = ("total_actions", "pending_atonements", "completed_atonements")
+SYSTEM_STAT_FIELDS = ("total_users", "total_actions", "total_atonements")
+
+# Counters are kept up to date with $inc at write time: users.stats holds each
+# user's counts and the counters collection holds the system-wide totals. Both
+# carry ``seeded`` once they have been initialized from real counts; until then
+# the first read counts once and seeds them. reconcile_stats repairs any drift.
+
+def user_stats_inc(**deltas):
+    """$inc fields for a user's materialized stats, to merge into an existing update."""
+    return {f"stats.{field}": delta for field, delta in deltas.items()}
+
+async def bump_user_stats(user_id, **deltas):
+    await async_users_col.update_one({"user_id": user_id}, {"$inc": user_stats_inc(**deltas)})
+
+async def bump_system_stats(**deltas):
+    await async_counters_col.update_one({"_id": SYSTEM_COUNTERS_ID}, {"$inc": deltas}, upsert=True)
+
+async def get_user_counters(user_doc):
+    """
+    Read a user's action and atonement counts from the user document.
+
+    Args:
+        user_doc (dict): The user document, projected with ``stats``
+
+    Returns:
+        dict: total_actions, pending_atonements and completed_atonements
+    """
+    stats = user_doc.get("stats") or {}
+    if stats.get("seeded"):
+        return {field: stats.get(field, 0) for field in USER_STAT_FIELDS}
+
+    user_id = user_doc["user_id"]
+    counts = dict(zip(USER_STAT_FIELDS, await asyncio.gather(
+        async_transactions_col.count_documents({"user_id": user_id}),
+        async_atonements_col.count_documents({"user_id": user_id, "status": "pending"}),
+        async_atonements_col.count_documents({"user_id": user_id, "status": "completed"})
+    )))
+    await async_users_col.update_one({"user_id": user_id}, {"$set": {"stats": {**counts, "seeded": True}}})
+    return counts
+
+async def get_system_counters():
+    """
+    Read the system-wide totals from the counters document.
+
+    Returns:
+        dict: total_users, total_actions and total_atonements
+    """
+    doc = await async_counters_col.find_one({"_id": SYSTEM_COUNTERS_ID}) or {}
+    if doc.get("seeded"):
+        return {field: doc.get(field, 0) for field in SYSTEM_STAT_FIELDS}
+
+    counts = dict(zip(SYSTEM_STAT_FIELDS, await asyncio.gather(
+        async_users_col.count_documents({}),
+        async_transactions_col.count_documents({}),
+        async_atonements_col.count_documents({})
+    )))
+    await async_counters_col.replace_one({"_id": SYSTEM_COUNTERS_ID}, {**counts, "seeded": True}, upsert=True)
+    return counts
+
+def reconcile_stats(batch_size=1000):
+    """
+    Recompute every counter from the collections and fix the ones that drifted.
+
+    Per-user counts come from one aggregation per collection; only users whose
+    stored stats differ are rewritten, in bulk_write batches of ``batch_size``.
+
+    Returns:
+        tuple: (users repaired, system totals)
+    """
+    actions = {
+        doc["_id"]: doc["count"]
+        for doc in transactions_col.aggregate([{"$group": {"_id": "$user_id", "count": {"$sum": 1}}}], allowDiskUse=True)
+    }
+    atonements = {}
+    for doc in atonements_col.aggregate([
+        {"$group": {"_id": {"user_id": "$user_id", "status": "$status"}, "count": {"$sum": 1}}}
+    ], allowDiskUse=True):
+        atonements[(doc["_id"]["user_id"], doc["_id"].get("status"))] = doc["count"]
+
+    repaired = 0
+    ops = []
+    for user in users_col.find({}, {"_id": 0, "user_id": 1, "stats": 1}):
+        user_id = user["user_id"]
+        expected = {
+            "total_actions": actions.get(user_id, 0),
+            "pending_atonements": atonements.get((user_id, "pending"), 0),
+            "completed_atonements": atonements.get((user_id, "completed"), 0),
+            "seeded": True
+        }
+        if user.get("stats") != expected:
+            ops.append(UpdateOne({"user_id": user_id}, {"$set": {"stats": expected}}))
+        if len(ops) >= batch_size:
+            repaired += users_col.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        repaired += users_col.bulk_write(ops, ordered=False).modified_count
+
+    totals = {
+        "total_users": users_col.count_documents({}),
+        "total_actions": transactions_col.count_documents({}),
+        "total_atonements": atonements_col.count_documents({})
+    }
+    counters_col.replace_one({"_id": SYSTEM_COUNTERS_ID}, {**totals, "seeded": True}, upsert=True)
+    return repaired, totals
@@ -0,0 +1,57 @@
+import bisect
+import numpy as np
+from config import LEVEL_THRESHOLDS, LOKA_THRESHOLDS
+
+class ThresholdIndex:
+    """
+    Classifies scores into labelled ranges using sorted lower bounds.
+
+    A score gets the label of the highest lower bound not above it. When upper
+    bounds are given the ranges are closed and a score past its range's upper
+    bound (i.e. in a gap between ranges) gets ``default``; without them each
+    range extends up to the next lower bound.
+    """
+
+    def __init__(self, lower_bounds, labels, upper_bounds=None, default=None):
+        if upper_bounds is None:
+            upper_bounds = [float("inf")] * len(lower_bounds)
+        ranges = sorted(zip(lower_bounds, upper_bounds, labels), key=lambda r: r[0])
+        for (_, upper, label), (lower, _, next_label) in zip(ranges, ranges[1:]):
+            if lower <= upper and upper != float("inf"):
+                raise ValueError(f"Threshold ranges for {label} and {next_label} overlap")
+
+        self.lower_bounds = [r[0] for r in ranges]
+        self.upper_bounds = [r[1] for r in ranges]
+        self.labels = [r[2] for r in ranges]
+        self.default = default
+        self._lower = np.array(self.lower_bounds, dtype=float)
+        self._upper = np.array(self.upper_bounds, dtype=float)
+        self._labels = np.array(self.labels)
+
+    def classify(self, score):
+        """Return the label for a single score."""
+        i = bisect.bisect_right(self.lower_bounds, score) - 1
+        if i < 0 or score > self.upper_bounds[i]:
+            return self.default
+        return self.labels[i]
+
+    def classify_many(self, scores, default=None):
+        """Return an array of labels for an array of scores."""
+        default = self.default if default is None else default
+        scores = np.asarray(scores, dtype=float)
+        index = np.searchsorted(self._lower, scores, side="right") - 1
+        safe_index = np.clip(index, 0, None)
+        hit = (index >= 0) & (scores <= self._upper[safe_index])
+        return np.where(hit, self._labels[safe_index], default)
+
+# Built once at import and shared by the scalar helpers and the batch scorer
+ROLE_INDEX = ThresholdIndex(
+    list(LEVEL_THRESHOLDS.values()),
+    list(LEVEL_THRESHOLDS.keys()),
+    default="learner"
+)
+LOKA_INDEX = ThresholdIndex(
+    [threshold["min_karma"] for threshold in LOKA_THRESHOLDS.values()],
+    list(LOKA_THRESHOLDS.keys()),
+    upper_bounds=[threshold["max_karma"] for threshold in LOKA_THRESHOLDS.values()]
+)
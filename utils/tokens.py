@@ -1,12 +1,16 @@
+import copy
 from datetime import datetime
-from database import users_col
-from config import TOKEN_ATTRIBUTES
-from datetime import datetime
+from database import async_users_col
+from config import TOKEN_ATTRIBUTES, LAZY_DECAY_READS
+
+# Flat tokens that decay or expire; PaapTokens are a nested map and never change here
+DECAYING_TOKENS = [token for token, attrs in TOKEN_ATTRIBUTES.items() if "daily_decay" in attrs]
 
 def now_utc():
     return datetime.utcnow()
 
-def apply_decay_and_expiry(user_doc):
+def compute_decay_and_expiry(user_doc):
+    """Apply decay and expiry to ``user_doc`` in memory without touching the database."""
     last_decay = user_doc.get("last_decay", now_utc())
     if isinstance(last_decay, str):
         last_decay = datetime.fromisoformat(last_decay)
@@ -36,10 +40,81 @@ def apply_decay_and_expiry(user_doc):
     user_doc["balances"] = balances
     user_doc["token_meta"] = meta
     user_doc["last_decay"] = now_utc()
+    return user_doc
+
+def decayed_balance_expr(token, now):
+    """
+    Aggregation expression for ``balances.<token>`` with decay and expiry applied as of ``now``.
+
+    Mirrors compute_decay_and_expiry for one flat token, so conditional updates
+    can check and materialize decayed balances on the server in the same write.
+
+    Args:
+        token (str): A flat (non-dict) token name from TOKEN_ATTRIBUTES
+        now (datetime): The time to age the balance to
+
+    Returns:
+        dict: An aggregation expression evaluating to the effective balance
+    """
+    attrs = TOKEN_ATTRIBUTES[token]
+    balance = {"$ifNull": [f"$balances.{token}", 0.0]}
+    delta_days = {"$divide": [{"$subtract": [now, {"$ifNull": ["$last_decay", now]}]}, 86400000.0]}
+    expr = balance
+
+    decay_rate = attrs.get("daily_decay", 0.0)
+    if decay_rate > 0:
+        decayed = {"$multiply": [balance, {"$pow": [1 - decay_rate, delta_days]}]}
+        expr = {"$cond": [{"$gt": [balance, 0]}, {"$max": [decayed, 0.0]}, balance]}
+
+    expiry_days = attrs.get("expiry_days", None)
+    if expiry_days:
+        created = {"$ifNull": [f"$token_meta.{token}.created_at", now]}
+        age_days = {"$divide": [{"$subtract": [now, created]}, 86400000.0]}
+        expr = {"$cond": [{"$gte": [age_days, expiry_days]}, 0.0, expr]}
 
-    users_col.update_one({"user_id": user_doc["user_id"]}, {"$set": {
-        "balances": balances,
-        "token_meta": meta,
+    # Like compute_decay_and_expiry, leave balances untouched until time has passed
+    return {"$cond": [{"$gt": [delta_days, 0]}, expr, balance]}
+
+async def apply_decay_and_expiry(user_doc):
+    """
+    Apply decay and expiry to ``user_doc`` and persist the result.
+
+    Balance changes are written as ``$inc`` deltas, and only if ``last_decay`` still
+    holds the value that was read, so debits and rewards that land between the read
+    and the write are kept and decay is never materialized twice. If the guard fails
+    the in-memory result is returned without writing.
+    """
+    previous_decay = user_doc.get("last_decay")
+    read_balances = {t: user_doc["balances"].get(t, 0) for t in DECAYING_TOKENS}
+    user_doc = compute_decay_and_expiry(user_doc)
+    if user_doc.get("last_decay") is previous_decay:
+        # Nothing decayed, so there is nothing to persist
+        return user_doc
+
+    increments = {f"balances.{t}": user_doc["balances"].get(t, 0) - read_balances[t] for t in DECAYING_TOKENS}
+    increments = {path: amount for path, amount in increments.items() if amount}
+    # None also matches documents that were never decayed
+    await async_users_col.update_one({"user_id": user_doc["user_id"], "last_decay": previous_decay}, {"$set": {
+        "token_meta": user_doc["token_meta"],
         "last_decay": user_doc["last_decay"]
-    }})
+    }, "$inc": {**increments, "version": 1}})
+    return user_doc
+
+def effective_balances(user_doc):
+    """Balances as of now with decay and expiry applied, without mutating ``user_doc`` or writing."""
+    snapshot = dict(user_doc)
+    snapshot["balances"] = copy.deepcopy(user_doc["balances"])
+    snapshot["token_meta"] = copy.deepcopy(user_doc.get("token_meta", {}))
+    return compute_decay_and_expiry(snapshot)["balances"]
+
+async def decay_for_read(user_doc):
+    """
+    Bring a user document's balances up to date for a read-only endpoint.
+
+    With LAZY_DECAY_READS the effective balances are computed in memory and nothing
+    is written; otherwise decay is materialized as before.
+    """
+    if not LAZY_DECAY_READS:
+        return await apply_decay_and_expiry(user_doc)
+    user_doc["balances"] = effective_balances(user_doc)
     return user_doc
@@ -1,10 +1,10 @@
-from database import transactions_col, users_col
 from datetime import datetime
+from config import USER_HISTORY_LIMIT
 
 def now_utc():
     return datetime.utcnow()
 
-def log_transaction(user_id, action, reward, intent, reward_tier, punishment_name=None):
+def build_transaction(user_id, action, reward, intent, reward_tier, punishment_name=None):
     tx = {
         "user_id": user_id,
         "action": action,
@@ -13,10 +13,13 @@ def log_transaction(user_id, action, reward, intent, reward_tier, punishment_nam
         "reward_tier": reward_tier,
         "timestamp": now_utc()
     }
-    
+
     # Add punishment name if provided (for cheat transactions)
     if punishment_name:
         tx["punishment_name"] = punishment_name
-    
-    transactions_col.insert_one(tx)
-    users_col.update_one({"user_id": user_id}, {"$push": {"history": tx}})
+
+    return tx
+
+def history_push(tx):
+    """$push clause that appends ``tx`` to users.history, keeping only the newest entries."""
+    return {"history": {"$each": [tx], "$slice": -USER_HISTORY_LIMIT}}
@@ -0,0 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+class KeyedLock:
+    """
+    One asyncio lock per key, created on demand and dropped when no task holds or awaits it.
+
+    Tasks using the same key run one at a time, in arrival order; different keys
+    never wait on each other.
+    """
+
+    def __init__(self):
+        # key -> [lock, number of tasks holding or waiting for it]
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+# Serializes read-modify-write operations on a user document within this process
+user_locks = KeyedLock()
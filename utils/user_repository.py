@@ -0,0 +1,32 @@
+from database import async_users_col
+
+# Named projections for user fetches, so each caller only pulls the fields it reads.
+# BALANCES carries the decay bookkeeping (token_meta, last_decay) needed to age balances.
+BALANCES = {"_id": 0, "user_id": 1, "balances": 1, "token_meta": 1, "last_decay": 1}
+ROLE_BALANCES = {**BALANCES, "role": 1}
+# Everything the action pipeline reads, including cheat history for progressive punishment
+# and the version used for optimistic concurrency
+ACTION_STATE = {**ROLE_BALANCES, "cheat_history": 1, "version": 1}
+# Balances plus the materialized action/atonement counters read by the stats endpoint
+STATS = {**ROLE_BALANCES, "stats": 1}
+# The whole profile minus the embedded ledgers
+PROFILE = {"history": 0, "cheat_history": 0, "redeem_keys": 0}
+EXISTS = {"_id": 1}
+FULL = None
+
+async def get_user(user_id, projection=ROLE_BALANCES):
+    """
+    Fetch a user document restricted to ``projection``.
+
+    Args:
+        user_id (str): The user's ID
+        projection (dict, optional): One of the named projections in this module
+
+    Returns:
+        dict: The projected user document or None if the user does not exist
+    """
+    return await async_users_col.find_one({"user_id": user_id}, projection)
+
+async def user_exists(user_id):
+    """Check whether a user exists without transferring the document."""
+    return await async_users_col.find_one({"user_id": user_id}, EXISTS) is not None
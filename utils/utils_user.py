@@ -1,10 +1,13 @@
-from database import users_col
+from pymongo.errors import DuplicateKeyError
+from database import async_users_col
+from utils.user_repository import get_user, FULL
 from datetime import datetime
 from utils.tokens import now_utc
+from utils.stats_counters import bump_system_stats
 from config import ROLE_SEQUENCE, TOKEN_ATTRIBUTES
 
-def create_user_if_missing(user_id: str, role: str = "learner"):
-    user = users_col.find_one({"user_id": user_id})
+async def create_user_if_missing(user_id: str, role: str = "learner", projection=FULL):
+    user = await get_user(user_id, projection)
     if user:
         return user
     
@@ -25,7 +28,15 @@ def create_user_if_missing(user_id: str, role: str = "learner"):
         "token_meta": {token: {"last_update": now_utc(), "created_at": now_utc()} for token in TOKEN_ATTRIBUTES},
         "last_decay": now_utc(),
         "history": [],
-        "cheat_history": []  # Initialize empty cheat history for progressive punishment system
+        "cheat_history": [],  # Initialize empty cheat history for progressive punishment system
+        # A new user has no actions or plans, so the materialized counters start seeded
+        "stats": {"total_actions": 0, "pending_atonements": 0, "completed_atonements": 0, "seeded": True},
+        "atonement_plan_count": 0
     }
-    users_col.insert_one(doc)
+    try:
+        await async_users_col.insert_one(doc)
+    except DuplicateKeyError:
+        # A concurrent first action created the user; the unique user_id index kept it to one
+        return await get_user(user_id, projection)
+    await bump_system_stats(total_users=1)
     return doc